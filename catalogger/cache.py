@@ -0,0 +1,220 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def _stat(path):
+    """
+    Stat the file that identifies the contents of a recording. A spike store directory is
+    represented by its times.npy, since rewriting a store in place does not reliably change
+    the directory's own size or modification time.
+    """
+    if os.path.isfile(os.path.join(path, 'meta.json')):
+        return os.stat(os.path.join(path, 'times.npy'))
+    return os.stat(path)
+
+
+class MetricsCache:
+    """
+    Persistent on-disk cache of per-recording metrics, stored as a SQLite sidecar file.
+    Entries are keyed by the acqm file fingerprint (path, size, mtime), the file suffix
+    and the metric version, so a changed file or a bumped metric version is recomputed.
+    """
+    def __init__(self, path):
+        """
+        Initialize MetricsCache.
+
+        Parameters:
+        path (str): Path to the SQLite file. Created on first use if it does not exist.
+        """
+        self.path = path
+        self._conn = None
+
+    @classmethod
+    def for_basepath(cls, basepath, filename='.catalogger_metrics.sqlite'):
+        """
+        Create a cache stored next to the data under basepath.
+
+        Parameters:
+        basepath (str): Base directory where data is stored.
+        filename (str): Name of the SQLite file inside basepath.
+
+        Returns:
+        MetricsCache: The cache object.
+        """
+        return cls(os.path.join(basepath, filename))
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                "path TEXT, suffix TEXT, name TEXT, version INTEGER, "
+                "size INTEGER, mtime_ns INTEGER, value TEXT, "
+                "PRIMARY KEY (path, suffix, name))"
+            )
+        return self._conn
+
+    @staticmethod
+    def fingerprint(path):
+        """
+        Get the fingerprint used to detect changed files.
+
+        Parameters:
+        path (str): Path to the acqm file or spike store directory.
+
+        Returns:
+        tuple: (absolute path, size in bytes, modification time in ns). For a spike store, size and
+               modification time are those of its times.npy.
+        """
+        st = _stat(path)
+        return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+    def get(self, path, suffix, versions):
+        """
+        Look up cached metrics for a file.
+
+        Parameters:
+        path (str): Path to the acqm file.
+        suffix (str): Suffix used to build the acqm path.
+        versions (dict): Metric names mapped to the version currently expected.
+
+        Returns:
+        dict: Metric names mapped to cached values. Only metrics whose file fingerprint
+              and version both match are returned.
+        """
+        abspath, size, mtime_ns = self.fingerprint(path)
+        rows = self.conn.execute(
+            "SELECT name, version, value FROM metrics WHERE path = ? AND suffix = ? AND size = ? AND mtime_ns = ?",
+            (abspath, suffix, size, mtime_ns)
+        ).fetchall()
+        return {name: json.loads(value) for name, version, value in rows
+                if name in versions and versions[name] == version}
+
+    def put(self, path, suffix, values, versions):
+        """
+        Store metrics for a file, replacing any older entries.
+
+        Parameters:
+        path (str): Path to the acqm file.
+        suffix (str): Suffix used to build the acqm path.
+        values (dict): Metric names mapped to JSON serializable values.
+        versions (dict): Metric names mapped to the version the values were computed with.
+        """
+        abspath, size, mtime_ns = self.fingerprint(path)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(abspath, suffix, name, versions[name], size, mtime_ns, json.dumps(value))
+                 for name, value in values.items()]
+            )
+
+    def close(self):
+        """
+        Close the underlying database connection.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class RecordingCache:
+    """
+    Bounded in-memory LRU cache of loaded recordings. The cache can be bounded by number of
+    entries, by the total number of spikes held, or both. Hit, miss and eviction counts are
+    kept so the bounds can be sized for a job.
+    """
+    def __init__(self, max_entries=None, max_spikes=None):
+        """
+        Initialize RecordingCache.
+
+        Parameters:
+        max_entries (int, optional): Maximum number of recordings kept. None for no limit.
+        max_spikes (int, optional): Maximum total number of spikes kept. None for no limit.
+        """
+        self.max_entries = max_entries
+        self.max_spikes = max_spikes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.spikes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(path):
+        """
+        Build the cache key for a file so a modified file is not served stale.
+
+        Parameters:
+        path (str): Path to the recording file or spike store directory (keyed by its times.npy).
+
+        Returns:
+        tuple: (absolute path, modification time in ns)
+        """
+        return os.path.abspath(path), _stat(path).st_mtime_ns
+
+    def get(self, key):
+        """
+        Get a cached recording and mark it as most recently used.
+
+        Parameters:
+        key (hashable): Cache key.
+
+        Returns:
+        object or None: The cached recording, None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, n_spikes=0):
+        """
+        Add a recording, evicting the least recently used ones until the bounds are met.
+        The newest recording is always kept, even if it alone exceeds max_spikes.
+
+        Parameters:
+        key (hashable): Cache key.
+        value (object): The loaded recording.
+        n_spikes (int): Number of spikes in the recording, counted against max_spikes.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.spikes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, n_spikes)
+            self.spikes += n_spikes
+            while len(self._entries) > 1 and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries)
+                    or (self.max_spikes is not None and self.spikes > self.max_spikes)):
+                _, (_, evicted_spikes) = self._entries.popitem(last=False)
+                self.spikes -= evicted_spikes
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all cached recordings. Statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.spikes = 0
+
+    def info(self):
+        """
+        Get cache statistics.
+
+        Returns:
+        dict: hits, misses, evictions, entries and spikes currently held.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'spikes': self.spikes}
+
+    def __len__(self):
+        return len(self._entries)
@@ -3,10 +3,207 @@ import sys
 import os
 import matplotlib.pyplot as plt
 import pandas as pd
-import re
+import hashlib
+import numpy as np
 from braingeneers.analysis import SpikeData, load_spike_data
 from braingeneers.data import datasets_electrophysiology as ephys
-
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from catalogger.normalize import normalize_catalog, add_chip_numbers, extract_chip_numbers
+
+
+def _cache_path(cache_dir, uuid):
+    """
+    Get the cache file of a uuid's metadata. Trailing slashes in uuids are ignored.
+    """
+    return os.path.join(cache_dir, uuid.strip('/').replace('/', '_') + '.json')
+
+
+def load_cached_metadata(uuid, cache_dir=None, max_age=24 * 60 * 60, load=None):
+    """
+    Load the metadata.json of a uuid, using a local copy while it is fresh.
+    
+    Parameters:
+    uuid (str): UUID of the experiment.
+    cache_dir (str, optional): Directory of cached metadata files (<uuid>.json, same shape as
+                               examples/example_metadata.json). None disables caching.
+    max_age (float, optional): Seconds a cached copy stays fresh. None keeps copies forever, 0 always refetches.
+    load (callable, optional): Function fetching the metadata of a uuid. Defaults to ephys.load_metadata.
+    
+    Returns:
+    dict: The metadata. A stale cached copy is returned if fetching fails, e.g. when offline.
+    """
+    load = load or ephys.load_metadata
+    path = _cache_path(cache_dir, uuid) if cache_dir is not None else None
+    if path is not None and os.path.exists(path):
+        if max_age is None or time.time() - os.path.getmtime(path) < max_age:
+            with open(path, 'r') as f:
+                return json.load(f)
+    try:
+        metadata = load(uuid)
+    except Exception as e:
+        if path is None or not os.path.exists(path):
+            raise
+        print(f"Warning: using cached metadata for {uuid}: {str(e)}")
+        with open(path, 'r') as f:
+            return json.load(f)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Unique temporary name, since uuids differing only by a trailing slash share a cache file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(tmp_path, path)
+    return metadata
+
+
+def fetch_metadata(uuids, cache_dir=None, max_age=24 * 60 * 60, max_workers=8, load=None):
+    """
+    Fetch the metadata of several uuids concurrently.
+    
+    Parameters:
+    uuids (list): UUIDs of the experiments.
+    cache_dir (str, optional): Directory of cached metadata files, see load_cached_metadata.
+    max_age (float, optional): Seconds a cached copy stays fresh.
+    max_workers (int): Number of metadata files fetched at the same time.
+    load (callable, optional): Function fetching the metadata of a uuid. Defaults to ephys.load_metadata.
+    
+    Returns:
+    dict: UUIDs mapped to their metadata, in the order of uuids.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(lambda uuid: load_cached_metadata(uuid, cache_dir, max_age, load), uuids)
+        return dict(zip(uuids, results))
+
+
+def metadata_frame(uuid, metadata):
+    """
+    Build the catalog rows of one uuid from its metadata.
+    
+    Parameters:
+    uuid (str): UUID of the experiment.
+    metadata (dict): The uuid's metadata.json contents.
+    
+    Returns:
+    pd.DataFrame: One row per ephys experiment.
+    """
+    experiment_names = [exp['name'] for exp in metadata['ephys_experiments'].values()]
+    experiment_dates = [exp['blocks'][0]['timestamp'] if 'blocks' in exp and len(exp['blocks']) > 0 and 'timestamp' in exp['blocks'][0] else None for exp in metadata['ephys_experiments'].values()]
+    data = {
+        'uuids': [uuid] * len(experiment_names),
+        'experiment_name': experiment_names,
+        'experiment_date': experiment_dates,
+        'sample_type': [metadata['notes']['biology']['sample_type']] * len(experiment_names),
+        'species': [metadata['notes']['biology']['species']] * len(experiment_names),
+        'cell_line': [metadata['notes']['biology']['cell_line']] * len(experiment_names),
+        'agg_date': [metadata['notes']['biology']['aggregation_date']] * len(experiment_names),
+        'plating_date': [metadata['notes']['biology']['plating_date']] * len(experiment_names),
+    }
+    return pd.DataFrame(data)
+
+
+def metadata_hash(metadata):
+    """
+    Hash the contents of a metadata.json, independent of key order.
+    
+    Parameters:
+    metadata (dict): The metadata.
+    
+    Returns:
+    str: Hex digest that changes whenever the metadata changes.
+    """
+    return hashlib.sha1(json.dumps(metadata, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def build_catalog(uuids, metadata):
+    """
+    Build and normalize the catalog rows of several uuids.
+    
+    Parameters:
+    uuids (list): UUIDs of the experiments.
+    metadata (dict): UUIDs mapped to their metadata, e.g. from fetch_metadata.
+    
+    Returns:
+    pd.DataFrame: Normalized catalog with a metadata_hash column.
+    """
+    dfs = []
+    for uuid in uuids:
+        frame = metadata_frame(uuid, metadata[uuid])
+        frame['metadata_hash'] = metadata_hash(metadata[uuid])
+        dfs.append(frame)
+    return normalize_catalog(pd.concat(dfs, ignore_index=True))
+
+
+def update_catalog_incremental(catalog, uuids, keep=None, **fetch_kwargs):
+    """
+    Bring a stored catalog up to date with the uuid list, rebuilding only new or changed uuids.
+    
+    A uuid is rebuilt when it is not in the catalog or when the hash of its metadata differs from
+    the catalog's metadata_hash column. Rows of unchanged uuids are kept as they are, so manual
+    fixes survive; only their chip_number is recomputed, and only when rebuilt rows share the chip.
+    Rows of uuids no longer in the list are dropped.
+    
+    Parameters:
+    catalog (pd.DataFrame): Stored catalog, e.g. read from catalog_baseline.csv. Catalogs without a
+                            metadata_hash column are rebuilt completely.
+    uuids (list): UUIDs the catalog should contain.
+    keep (list, optional): Columns whose stored values are carried over to rebuilt rows of the same
+                           experiment. Defaults to the columns that the build does not produce,
+                           e.g. manually added annotations.
+    **fetch_kwargs: Passed to fetch_metadata, e.g. cache_dir or max_workers.
+    
+    Returns:
+    tuple: (catalog, changes) where changes maps 'added', 'changed', 'removed' and 'unchanged' to uuid lists.
+    """
+    metadata = fetch_metadata(uuids, **fetch_kwargs)
+    stored = catalog.groupby('uuids', sort=False)['metadata_hash'].first().to_dict() \
+        if 'metadata_hash' in catalog else {}
+    changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': []}
+    known, wanted = set(catalog['uuids']), set(uuids)
+    for uuid in uuids:
+        if uuid not in known:
+            changes['added'].append(uuid)
+        elif stored.get(uuid) != metadata_hash(metadata[uuid]):
+            changes['changed'].append(uuid)
+        else:
+            changes['unchanged'].append(uuid)
+    changes['removed'] = [uuid for uuid in catalog['uuids'].unique() if uuid not in wanted]
+    print(f"{len(changes['added'])} new, {len(changes['changed'])} changed, {len(changes['removed'])} removed, "
+          f"{len(changes['unchanged'])} unchanged uuids")
+
+    rebuild = changes['added'] + changes['changed']
+    if not rebuild:
+        merged = catalog[catalog['uuids'].isin(uuids)]
+    else:
+        fresh = build_catalog(rebuild, metadata)
+        keep = [column for column in catalog.columns if column not in fresh.columns] if keep is None else keep
+        if keep:
+            # Stored values of the kept columns win for experiments that are still there
+            old = catalog.drop_duplicates(['uuids', 'experiment_name']).set_index(['uuids', 'experiment_name'])
+            rows = pd.MultiIndex.from_frame(fresh[['uuids', 'experiment_name']])
+            for column in keep:
+                values = old[column].reindex(rows).to_numpy()
+                if column in fresh:
+                    values = np.where(pd.isna(values), fresh[column].to_numpy(dtype=object), values)
+                fresh[column] = values
+        unchanged = catalog[catalog['uuids'].isin(changes['unchanged'])].copy()
+        for column in ('experiment_date', 'agg_date'):
+            unchanged[column] = pd.to_datetime(unchanged[column], errors='coerce')
+        unchanged['org_age'] = pd.to_timedelta(unchanged['org_age'], errors='coerce')
+        order = {uuid: i for i, uuid in enumerate(uuids)}
+        merged = pd.concat([unchanged, fresh], ignore_index=True)
+        merged = merged.iloc[merged['uuids'].map(order).argsort(kind='stable')]
+        # A new plate can change the d/e suffix of chips that were already in the catalog, so chip
+        # groups with rebuilt rows are renumbered; rows of other chips keep their stored chip_number
+        stored_chips = merged['chip_number'].copy() if 'chip_number' in merged else None
+        chips = extract_chip_numbers(merged['experiment_name']).fillna('unknown')
+        affected = chips.isin(chips[merged['uuids'].isin(rebuild)])
+        merged = add_chip_numbers(merged)
+        if stored_chips is not None:
+            merged['chip_number'] = merged['chip_number'].where(affected | stored_chips.isna(), stored_chips)
+    return merged.reset_index(drop=True), changes
 
 
 if __name__ == '__main__':
@@ -85,244 +282,28 @@ if __name__ == '__main__':
 
 
     add_s3_paths = True
+    # Only rebuild uuids that are new or whose metadata changed since the stored catalog was written
+    incremental = True
+    catalog_path = '../analysis/orgs/general_analysis/catalog_baseline.csv'
 
-    dfs = []  # list to hold individual dataframes
-    if add_s3_paths== True:
-        for uuid in uuids:  
-            print(f"retrieving data for 'uuid': {uuid}")
-            metadata = ephys.load_metadata(uuid)
-            experiment_names = [exp['name'] for exp in metadata['ephys_experiments'].values()]
-            experiment_dates = [exp['blocks'][0]['timestamp'] if 'blocks' in exp and len(exp['blocks']) > 0 and 'timestamp' in exp['blocks'][0] else None for exp in metadata['ephys_experiments'].values()]
-            data = {
-                'uuids': [uuid] * len(experiment_names),
-                'experiment_name': experiment_names,
-                'experiment_date': experiment_dates,
-                'sample_type': [metadata['notes']['biology']['sample_type']] * len(experiment_names),
-                'species': [metadata['notes']['biology']['species']] * len(experiment_names),
-                'cell_line': [metadata['notes']['biology']['cell_line']] * len(experiment_names),
-                'agg_date': [metadata['notes']['biology']['aggregation_date']] * len(experiment_names),
-                'plating_date': [metadata['notes']['biology']['plating_date']] * len(experiment_names),
-            }
-            df = pd.DataFrame(data)
-            dfs.append(df)
-
-        # concatenate all the individual dataframes
-        df = pd.concat(dfs, ignore_index=True)
-
-    elif add_s3_paths == False:
-        df = pd.read_csv('catalog_baseline.csv')
-    
-
-
-
-    
-    # Convert 'experiment_date' and 'agg_date' to datetime
-    df['experiment_date'] = pd.to_datetime(df['experiment_date'], errors='coerce')
-    
-    # Parse 'agg_date' with automatic format inference
-    df['agg_date'] = pd.to_datetime(df['agg_date'], errors='coerce')
-    
-    # Create 'org_age' column
-    df['org_age'] = df['experiment_date'] - df['agg_date']
-    
-    
-    
-    #code specific for the sakura baseline project
-    
-    # Define a dictionary where the keys are the uuids and the values are the correct agg_dates
-    correct_agg_dates = {
-        '2024-05-21-e-all_cell_lines_dorsal_pasca': '2024-04-09',
-        '2024-05-10-e-all_cell_lines_dorsal_pasca': '2024-04-09',
-        '2024-05-17-e-all_cell_lines_dorsal_pasca': '2024-04-09',
-        '2024-05-24-e-all_cell_lines_dorsal_pasca': '2024-04-09',
-        '2024-05-28-e-all_cell_lines_dorsal_pasca': '2024-04-09',
-        '2024-05-31-e-all_cell_lines_dorsal_pasca': '2024-04-09',
-    }
-    
-    # Convert the dates to datetime
-    for uuid, date in correct_agg_dates.items():
-        correct_agg_dates[uuid] = pd.to_datetime(date)
-    
-    # Update the agg_date for the specified uuids
-    for uuid, date in correct_agg_dates.items():
-        df.loc[df['uuids'] == uuid, 'agg_date'] = date
-    
-    # Recalculate the 'org_age' column
-    df['org_age'] = df['experiment_date'] - df['agg_date']
-    
-    
-    #correct the cell lines for specific uuids
-    correct_cell_lines = {
-        '2024-05-04-e-sakura-day22and24_dorothy': 'e14 and kh2',
-    }
-    # Update the cell_line for the specified uuids
-    for uuid, cell_line in correct_cell_lines.items():
-        df.loc[df['uuids'] == uuid, 'cell_line'] = cell_line
-    
-    #update the cell lines by parsing names
-    df['cell_line'] = df['cell_line'].replace('e14', 'E14')
-    df['cell_line'] = df['cell_line'].replace('kh2', 'KH2')
-    df['cell_line'] = df['cell_line'].replace('c57bl6', 'C57BL6')
-    df['cell_line'] = df['cell_line'].replace('c57', 'C57BL6')
-    
-    mask = df['experiment_name'].str.contains('c57bl6|C57BL6|"C57,|C57')
-    df.loc[mask, 'cell_line'] = 'C57BL6'
-    mask = df['experiment_name'].str.contains('e14|E14|E14"')
-    df.loc[mask, 'cell_line'] = 'E14'
-    mask = df['experiment_name'].str.contains('kh2|KH2|KH2,')
-    df.loc[mask, 'cell_line'] = 'KH2'
-    
-    #individual fix for cell line
-    df.loc[df['experiment_name'] == 'Trace_20240504_12_42_01_22064_day22_ventral', 'cell_line'] = 'KH2'
-    
-    #individual fix for age
-    df.loc[df['experiment_name'] == 'Trace_20240510_11_55_52_20264_28_ventral_kh2', 'org_age'] = pd.to_timedelta('28 days')
-    df.loc[df['experiment_name'] == 'Trace_20240510_11_19_56_22717_28_dorsa_kh2', 'org_age'] = pd.to_timedelta('28 days')
-    
-    #Change the sample type from "mouse organoid" to "organoid"
-    df['sample_type'] = df['sample_type'].replace('mouse organoid', 'organoid')
-    #if the string gfcdm is in sample_type add gfcdm to a new column: media 
-    df.loc[df['sample_type'].str.contains('gfcdm'), 'media'] = 'gfcdm'
-    #if slice is in the sample_type change species to mouse
-    df.loc[df['sample_type'].str.contains('slice'), 'species'] = 'mouse'
-    
-    
-    #if organoid string is in sample_type change to organoid
-    df.loc[df['sample_type'].str.contains('organoid'), 'species'] = 'organoid'
-    
-    
-    #Make a new column that has dorsal and ventral if dorsal or ventral is in experiment name 
-    df['patterning'] = df['experiment_name'].apply(lambda x: 'dorsal' if 'dorsa' in x.lower() else 'ventral' if 'ventral' in x.lower() else 'unknown')
-
-    
-    #manually change patterning
-    df.loc[df['experiment_name'] == 'Trace_20240510_11_19_56_22717_28_dorsal_kh2', 'patterning'] = 'dorsal'
-    
-    #manually change the uuid to mouse slice
-    df.loc[df['uuids'] == '2024-01-31-e-auto-mouse-slice/', 'sample_type'] = 'P0 mouse slice'
-    
-    #if the string slice is in sample_type change to cell line to C57BL6
-    df.loc[df['sample_type'].str.contains('slice'), 'cell_line'] = 'C57BL6'
-    
-    #if the string day26 is in experiment_name change age to 26 days
-    df.loc[df['experiment_name'].str.contains('day26'), 'org_age'] = pd.to_timedelta('26 days')
-    # df.loc[df['experiment_name'].str.contains('day27'), 'org_age'] = pd.to_datetime('27 days')
-
-    # if the string day42 is in experiment_name change age to 42 days
-    df.loc[df['experiment_name'].str.contains('day42'), 'org_age'] = pd.to_timedelta('42 days')
-    
-    #if this string is in the experiment name take out of the dataframe
-    df = df[~df['experiment_name'].str.contains('Trace_20240327_13_09_43_p001384')]
-
-    # if string 'pasca' is in the experiment name change the media to sakura
-    df.loc[df['experiment_name'].str.contains('pasca'), 'media'] = 'sakura'
+    # Metadata files are fetched concurrently and cached next to the catalog
+    metadata_cache = os.path.join(working_dir, 'metadata_cache')
 
-    # if string ventral is in experiment name change the media to sakura
-    df.loc[df['experiment_name'].str.contains('ventral'), 'media'] = 'sakura'
+    if add_s3_paths == True and incremental and os.path.exists(catalog_path):
+        df, changes = update_catalog_incremental(pd.read_csv(catalog_path), uuids, cache_dir=metadata_cache)
 
-    # if string nosynaptic is in experiment name chagne the drug to nbqx
-    df.loc[df['experiment_name'].str.contains('nosynaptic'), 'drug'] = 'nbqx + apv + gabazine'
+    elif add_s3_paths== True:
+        print(f"retrieving metadata for {len(uuids)} uuids")
+        metadata = fetch_metadata(uuids, cache_dir=metadata_cache)
 
+        # Dates, org_age, the labelling rules of catalog_rules.json and chip numbers are applied in one sweep
+        df = build_catalog(uuids, metadata)
 
-    # if string interneurons is in uuids change the media to sakura and the patterning to ventral 
-    df.loc[df['uuids'].str.contains('interneurons'), 'media'] = 'sakura'
-    df.loc[df['uuids'].str.contains('interneurons'), 'patterning'] = 'ventral'
-    
-    #add a drug column
-    #if the drug contains upper or lower case gabazine put in drug column gabazine 
-    df.loc[df['experiment_name'].str.contains('gabazine', case=False), 'drug'] = 'gabazine'
-    #if the drug contains upper or lower case bicuculline put in drug column bicuculline
-    df.loc[df['experiment_name'].str.contains('bicuculline', case=False), 'drug'] = 'bicuculine'
-    #if the drug contains upper or lower case apv put in drug column apv
-    df.loc[df['experiment_name'].str.contains('apv', case=False), 'drug'] = 'apv'
-    #if the drug contains upper or lower case dmso put in drug column dmso
-    df.loc[df['experiment_name'].str.contains('dmso', case=False), 'drug'] = 'dmso'
-    #if the string contains upper or lower case cch put in drug column carbachol
-    df.loc[df['experiment_name'].str.contains('cch', case=False), 'drug'] = 'carbachol'
-    #if the string contains upper or lower case baseline or bl put in drug column baseline
-    df.loc[df['experiment_name'].str.contains('baseline', case=False), 'drug'] = 'baseline'
-    #if the string contains upper or lower case nbqx put in drug column nbqx
-    df.loc[df['experiment_name'].str.contains('nbqx', case=False), 'drug'] = 'nbqx'
-    #if the string contains upper or lower case dopamine put in drug column dopamine
-    df.loc[df['experiment_name'].str.contains('dopamine', case=False), 'drug'] = 'dopamine'
-    #if the string contains upper or lower case gaba put in drug column gaba
-    df.loc[df['experiment_name'].str.contains('gaba', case=False), 'drug'] = 'gaba'
-    df.loc[df['experiment_name'].str.contains('carbachol', case=False), 'drug'] = 'carbachol'
-    
-    
-    #if it is a specific uuid change species to mouse
-    df.loc[df['uuids'] == '2024-01-31-e-auto-mouse-slice/', 'species'] = 'mouse'
-    df.loc[df['uuids'] == '2024-04-04-e-p001384-pharma-reupload/', 'species'] = 'mouse'
-    
-    #if the string gfcdm is in media change the patterning to dorsal 
-    df.loc[df['media'] == 'gfcdm', 'patterning'] = 'dorsal'
-    
-    #if it is a specific uuid change the plating_date to 3/9/2024
-    df.loc[df['uuids'] == '2024-03-20-e-auto-mouse-slice-22542/', 'plating_date'] = pd.to_datetime('2024-03-09')
-    
-    #add sakura to the media column
-    df.loc[df['uuids'].str.contains('pasca|sakura', case=False), 'media'] = 'sakura'
-
-    #if the chip in is the list to catch any that are not in the right naming convention 
-    list_of_chips = ['21985', '22717', '20264', '22064', '22194', '20402', '23150', '23178', '23156', 
-                    '23120', '23187', '23139','22710', '23141', '23137', '23215', '23179', '23124',
-                    '22542', '20215', '20380', 'p001384', '20174a', 'p001354', '20247', '25244',
-                    '25136', '23117b', '23117f', '23117F', '23117d', '25126d', '25158', '25123', '23154', 
-                    '25126', '25122', '22064b', '22150b', '22097', '23119a', '22150a', '23196', 
-                    '23119','23196', '23149']
-
-    def extract_chip_number(experiment_name):
-        # First, try to find the chip number using regex for patterns like "chip22542"
-        match = re.search(r'chip(\d+)', experiment_name)
-        if match:
-            return match.group(1)
-        
-        # If that doesn't work, try to find any number from the list_of_chips
-        for chip in list_of_chips:
-            if chip in experiment_name:
-                return chip
-        
-        # If still no match, try to find any number at the start of the string
-        match = re.search(r'^\d+', experiment_name)
-        if match:
-            return match.group()
-        
-        # If no match is found, return None or a placeholder
-        return None  # or 'N/A'
-    
-
-    # Apply the function to the 'experiment_name' column
-    df['chip_number'] = df['experiment_name'].apply(extract_chip_number)
-
-    # Fill None values in 'chip_number' with a placeholder
-    df['chip_number'] = df['chip_number'].fillna('unknown')
-
-    # Convert 'experiment_date' to datetime
-    df['experiment_date'] = pd.to_datetime(df['experiment_date'])
-
-    # Iterate through all the chips in the sakura catalog
-    for chips in df['chip_number'].unique():
-        chip_catalog = df[df['chip_number'] == chips]
-
-        # Check if the chip number already ends with 'd' or 'e'
-        if chips.endswith('d') or chips.endswith('e'):
-            continue
-
-        # If the chip has a date before 5/31/2024 it should be treated as a separate chip so add a 'd' to the end of the chip number
-        # If the chip has a date after 5/31/2024 it should be treated as a separate chip so add a 'e' to the end of the chip number
-        if chip_catalog['experiment_date'].max() < pd.to_datetime('2024-05-31'):
-            df.loc[df['chip_number'] == chips, 'chip_number'] = chips + 'd'
-        else:
-            df.loc[df['chip_number'] == chips, 'chip_number'] = chips + 'e'
+    elif add_s3_paths == False:
+        df = normalize_catalog(pd.read_csv('catalog_baseline.csv'))
 
     # Display the first few rows of the result
     print(df[['experiment_name', 'chip_number']].head())
 
-    
-
-        
-    
     # Save the DataFrame to a CSV file
-    df.to_csv('../analysis/orgs/general_analysis/catalog_baseline.csv', index=False)
-    
-    
\ No newline at end of file
+    df.to_csv(catalog_path, index=False)
@@ -1,92 +1,66 @@
-import boto3
-import os
-from botocore.client import Config
+from catalogger.s3_downloader import download_s3_files as _download
 
-def download_s3_files(endpoint_url, bucket_name, uuids, local_directory):
-    # Initialize the S3 client with the custom endpoint
-    s3 = boto3.client('s3', endpoint_url=endpoint_url, config=Config(signature_version='s3v4'))
 
-    #assert that the local directory exists
-    assert os.path.exists(local_directory), f"Local directory {local_directory} does not exist!"
+def download_s3_files(endpoint_url, bucket_name, uuids, local_directory, **kwargs):
+    # Objects are listed page by page and downloaded concurrently; files already present are skipped
+    return _download(endpoint_url, bucket_name, uuids, local_directory,
+                     prefix_template="ephys/{uuid}/derived/autocuration/", suffix=None, **kwargs)
 
-    try:
-        for uuid in uuids:
-            # Construct the prefix for this UUID
-            prefix = f"ephys/{uuid}/derived/autocuration/"
 
-            # List objects with this prefix
-            response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+if __name__ == '__main__':
+    # Example usage
+    endpoint_url = 'https://s3-west.nrp-nautilus.io'
+    bucket_name = 'braingeneers'
+    # uuids = [
+    #     "2024-05-04-e-sakura-day22and24",
+    #     "2024-05-04-e-sakura-day22and24_dorothy",
+    #     "2024-05-10-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params    # Downloaded
+    #     "2024-05-17-e-all_cell_lines_dorsal_pasca",
+    #     "2024-05-21-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params    # Downloaded some 
+    #     "2024-05-07-e-c57bl6_dorsal_pasca",
+    #     "2024-05-07-e-e14_dorsal_pasca",
+    #     "2024-05-07-e-kh2_dorsal_pasca",
+    #     "2024-05-24-e-all_cell_lines_dorsal_pasca",
+    #     "2024-05-28-e-all_cell_lines_dorsal_pasca",
+    #     "2024-05-31-e-all_cell_lines_dorsal_pasca",
+    #     "2024-06-11-e-all_cell_lines_dorsal_pasca",
+    #     "2024-06-14-e-all_cell_lines_dorsal_pasca",
+    #     "2024-06-18-e-all_cell_lines_dorsal_pasca",
+    #     "2024-06-19-e-sakura-ventral-day46", 
+    #     "2024-06-21-e-all_cell_lines_dorsal_pasca", 
+    #     "2024-06-21-e-cady-sakura-dorsal-ventral", #sent job for new SNR params #downloaded
+    #     # "2024-06-21-e-sakura-dorsa-ventral/"  #not spike sorted
+    #     "2024-03-20-e-auto-mouse-slice-22542",
+    #     "2024-02-06-e-auto-mouse-slice2",
+    #     "2024-01-31-e-auto-mouse-slice",
+    #     "2024-04-04-e-p001384-pharma-reupload",
+    #     "2024-02-09-e-pharma1-20380-HS",
+    #     "2024-07-01-e-sakura-drugs-22194",
+    #     "2024-06-24-e-sakura-drugs-22097", # sent job for new SNR params # downloaded 
+    #     "2024-06-25-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params # downloaded
+    #     "2024-06-28-e-all_cell_lines_dorsal_pasca",
+    #     "2024-07-01-e-sakura-drugs-22717",
+    #     "2024-07-02-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params # downloaded
+    #     "2024-07-02-e-sakura-drugs-20174a",
+    #     "2024-07-02-e-sakura-drugs-20264",
+    #     "2024-07-03-e-sakura-drugs-21985",
+    #     "2024-07-05-e-all_cell_lines_dorsal_pasca",
+            #   '2024-03-29-e-interneurons_44',
+            #   '2024-04-10-e-interneurons_56',
+            #   '2024-04-11-e-interneurons-pasca-57',
+            #   '2024-11-04-e-ventral_day44',
+            #   '2024-10-25-e-ventral-day33',
+    # ]
+    #missed recordings redownload
+    uuids = [
+        '2024-08-23-e-',
+        '2024-09-06-e-ventral_day52',
+        '2024-09-04-e-ventral_day50',
+        '2024-03-29-e-interneurons_44',
+        '2024-06-21-e-cady-sakura-dorsal-ventral',
+        '2024-06-11-e-all_cell_lines_dorsal_pasca'
+    ]
 
-            # Download each matching object
-            for obj in response.get('Contents', []):
-                file_key = obj['Key']
-                local_file_path = os.path.join(local_directory, uuid, os.path.relpath(file_key, prefix))
+    local_directory = '/Volumes/hunter_ssd/sakura_ephys_data/recs_low_isi'
 
-                # Ensure the subdirectory exists
-                os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-
-                # Download the file
-                print(f"Downloading {file_key} to {local_file_path}")
-                s3.download_file(bucket_name, file_key, local_file_path)
-
-        print("Download complete!")
-
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-
-# Example usage
-endpoint_url = 'https://s3-west.nrp-nautilus.io'
-bucket_name = 'braingeneers'
-# uuids = [
-#     "2024-05-04-e-sakura-day22and24",
-#     "2024-05-04-e-sakura-day22and24_dorothy",
-#     "2024-05-10-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params    # Downloaded
-#     "2024-05-17-e-all_cell_lines_dorsal_pasca",
-#     "2024-05-21-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params    # Downloaded some 
-#     "2024-05-07-e-c57bl6_dorsal_pasca",
-#     "2024-05-07-e-e14_dorsal_pasca",
-#     "2024-05-07-e-kh2_dorsal_pasca",
-#     "2024-05-24-e-all_cell_lines_dorsal_pasca",
-#     "2024-05-28-e-all_cell_lines_dorsal_pasca",
-#     "2024-05-31-e-all_cell_lines_dorsal_pasca",
-#     "2024-06-11-e-all_cell_lines_dorsal_pasca",
-#     "2024-06-14-e-all_cell_lines_dorsal_pasca",
-#     "2024-06-18-e-all_cell_lines_dorsal_pasca",
-#     "2024-06-19-e-sakura-ventral-day46", 
-#     "2024-06-21-e-all_cell_lines_dorsal_pasca", 
-#     "2024-06-21-e-cady-sakura-dorsal-ventral", #sent job for new SNR params #downloaded
-#     # "2024-06-21-e-sakura-dorsa-ventral/"  #not spike sorted
-#     "2024-03-20-e-auto-mouse-slice-22542",
-#     "2024-02-06-e-auto-mouse-slice2",
-#     "2024-01-31-e-auto-mouse-slice",
-#     "2024-04-04-e-p001384-pharma-reupload",
-#     "2024-02-09-e-pharma1-20380-HS",
-#     "2024-07-01-e-sakura-drugs-22194",
-#     "2024-06-24-e-sakura-drugs-22097", # sent job for new SNR params # downloaded 
-#     "2024-06-25-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params # downloaded
-#     "2024-06-28-e-all_cell_lines_dorsal_pasca",
-#     "2024-07-01-e-sakura-drugs-22717",
-#     "2024-07-02-e-all_cell_lines_dorsal_pasca", #sent job for new SNR params # downloaded
-#     "2024-07-02-e-sakura-drugs-20174a",
-#     "2024-07-02-e-sakura-drugs-20264",
-#     "2024-07-03-e-sakura-drugs-21985",
-#     "2024-07-05-e-all_cell_lines_dorsal_pasca",
-        #   '2024-03-29-e-interneurons_44',
-        #   '2024-04-10-e-interneurons_56',
-        #   '2024-04-11-e-interneurons-pasca-57',
-        #   '2024-11-04-e-ventral_day44',
-        #   '2024-10-25-e-ventral-day33',
-# ]
-#missed recordings redownload
-uuids = [
-    '2024-08-23-e-',
-    '2024-09-06-e-ventral_day52',
-    '2024-09-04-e-ventral_day50',
-    '2024-03-29-e-interneurons_44',
-    '2024-06-21-e-cady-sakura-dorsal-ventral',
-    '2024-06-11-e-all_cell_lines_dorsal_pasca'
-]
-
-local_directory = '/Volumes/hunter_ssd/sakura_ephys_data/recs_low_isi'
-
-download_s3_files(endpoint_url, bucket_name, uuids, local_directory)
\ No newline at end of file
+    download_s3_files(endpoint_url, bucket_name, uuids, local_directory)
@@ -0,0 +1,126 @@
+import io
+import struct
+import zipfile
+import numpy as np
+
+# Size of the fixed part of a zip local file header, see the zip APPNOTE section 4.3.7
+_LOCAL_HEADER_SIZE = 30
+_HEADER_READERS = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0,
+}
+
+
+class _MappedReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a memory-mapped byte range.
+    """
+    def __init__(self, buf):
+        self._buf = memoryview(buf)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        else:
+            pos = len(self._buf) + offset
+        self._pos = max(0, pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), len(self._buf) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def _data_offset(buf, header_offset):
+    """
+    Get the offset of a member's data from the start of its local file header.
+    """
+    name_len, extra_len = struct.unpack('<HH', bytes(buf[header_offset + 26:header_offset + _LOCAL_HEADER_SIZE]))
+    return header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len
+
+
+class MappedNpz:
+    """
+    Read-only view of an uncompressed .npz member of a zip file, backed by a memory map.
+    Supports the parts of np.lib.npyio.NpzFile used by the loaders (`key in npz`, `npz[key]`).
+    Plain numeric arrays stored uncompressed are returned as zero-copy views of the map;
+    object arrays and compressed entries are read through np.load.
+    """
+    def __init__(self, zip_path, info):
+        """
+        Initialize MappedNpz.
+
+        Parameters:
+        zip_path (str): Path to the outer zip file.
+        info (zipfile.ZipInfo): Entry of the .npz member, which must be stored uncompressed.
+        """
+        with open(zip_path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(_LOCAL_HEADER_SIZE)
+        name_len, extra_len = struct.unpack('<HH', header[26:_LOCAL_HEADER_SIZE])
+        start = info.header_offset + _LOCAL_HEADER_SIZE + name_len + extra_len
+        self._buf = np.memmap(zip_path, dtype=np.uint8, mode='r', offset=start, shape=(info.file_size,))
+        self._npz = zipfile.ZipFile(_MappedReader(self._buf))
+        self.files = [name[:-4] for name in self._npz.namelist() if name.endswith('.npy')]
+
+    def __contains__(self, key):
+        return key in self.files
+
+    def __getitem__(self, key):
+        if key not in self.files:
+            raise KeyError(f"{key} is not a file in the archive")
+        info = self._npz.getinfo(key + '.npy')
+        if info.compress_type != zipfile.ZIP_STORED:
+            return np.load(self._npz.open(info), allow_pickle=True)
+        start = _data_offset(self._buf, info.header_offset)
+        member = self._buf[start:start + info.file_size]
+        reader = _MappedReader(member)
+        version = np.lib.format.read_magic(reader)
+        read_header = _HEADER_READERS.get(version)
+        if read_header is None:
+            reader.seek(0)
+            return np.load(reader, allow_pickle=True)
+        shape, fortran_order, dtype = read_header(reader)
+        if dtype.hasobject:
+            reader.seek(0)
+            return np.load(reader, allow_pickle=True)
+        count = int(np.prod(shape))
+        array = np.frombuffer(member, dtype=dtype, count=count, offset=reader.tell())
+        return array.reshape(shape, order='F' if fortran_order else 'C')
+
+    def close(self):
+        self._npz.close()
+
+
+def open_npz(f_zip, zip_path, name):
+    """
+    Open a .npz member of a zip file, memory-mapping it when it is stored uncompressed.
+
+    Parameters:
+    f_zip (zipfile.ZipFile): The open outer zip file.
+    zip_path (str): Path to the outer zip file.
+    name (str): Name of the .npz member.
+
+    Returns:
+    MappedNpz or NpzFile: Mapping of array names to arrays.
+    """
+    info = f_zip.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED and info.file_size > 0 and not info.flag_bits & 0x1:
+        return MappedNpz(zip_path, info)
+    return np.load(f_zip.open(info), allow_pickle=True)
@@ -0,0 +1,295 @@
+"""
+Declarative normalization of catalog metadata.
+
+Rules live in a JSON table (catalog_rules.json by default) of pattern -> column -> value with an
+explicit priority. All rules of a stage that read the same column are compiled into one matcher, so
+each distinct value of a column is scanned once per stage no matter how many rules there are. Where
+several matching rules write the same cell, the one with the highest priority wins.
+"""
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), 'catalog_rules.json')
+_TYPES = {
+    'datetime': pd.to_datetime,
+    'timedelta': pd.to_timedelta,
+}
+
+
+def load_rules(path=None):
+    """
+    Load a normalization rule table.
+
+    Parameters:
+    path (str, optional): Path to the JSON rule table. Defaults to the rules shipped with catalogger.
+
+    Returns:
+    list: Stages, each a dict with 'name', 'rules' and optional 'defaults'.
+    """
+    with open(path or RULES_PATH, 'r') as f:
+        stages = json.load(f)['stages']
+    for stage in stages:
+        for rule in stage['rules']:
+            unknown = set(rule) - {'column', 'pattern', 'match', 'flags', 'set', 'types', 'priority', 'drop'}
+            if unknown or 'column' not in rule or 'pattern' not in rule:
+                raise ValueError(f"Invalid rule in stage {stage.get('name')}: {rule}")
+            if rule.get('match', 'regex') not in ('regex', 'exact'):
+                raise ValueError(f"Unknown match type {rule['match']!r}, use 'regex' or 'exact'")
+    return stages
+
+
+_SPECIAL = set('.^$*+?{}[]\\|()')
+
+
+def _literals(rule):
+    """
+    Get the alternatives of a rule whose pattern is a plain alternation of literals, or None.
+    """
+    if rule.get('match') == 'exact' or set(rule.get('flags', '')) - {'i'}:
+        return None
+    alternatives = rule['pattern'].split('|')
+    if any(not literal or _SPECIAL & set(literal) for literal in alternatives):
+        return None
+    return alternatives
+
+
+class ColumnMatcher:
+    """
+    Match every rule that reads one column in a single pass over the column's distinct values.
+
+    Exact rules are dictionary lookups. Rules that are alternations of literals are merged into one
+    longest-first alternation that is scanned once per value, Aho-Corasick style; each hit also
+    reports the shorter literals it starts with, so overlapping literals like 'gaba' and 'gabazine'
+    are all found. Only the remaining regex rules are searched one by one.
+    """
+    def __init__(self, rules):
+        """
+        Initialize ColumnMatcher.
+
+        Parameters:
+        rules (list): Rules reading the column.
+        """
+        self.rules = rules
+        self.exact, self.regexes = {}, []
+        literals = []
+        for i, rule in enumerate(rules):
+            alternatives = _literals(rule)
+            if rule.get('match') == 'exact':
+                self.exact.setdefault(rule['pattern'], []).append(i)
+            elif alternatives is not None:
+                literals.extend((literal, i, 'i' not in rule.get('flags', '')) for literal in alternatives)
+            else:
+                flags = rule.get('flags', '')
+                self.regexes.append((i, re.compile(f"(?{flags}:{rule['pattern']})" if flags else rule['pattern'])))
+        # The scan runs on lowercased values; case sensitive literals are checked again at the hit
+        keys = sorted({literal.lower() for literal, _, _ in literals}, key=len, reverse=True)
+        self.scan = re.compile('(?=(' + '|'.join(map(re.escape, keys)) + '))') if keys else None
+        self.hits = {key: [(literal, i, case) for literal, i, case in literals if key.startswith(literal.lower())]
+                     for key in keys}
+
+    def match_value(self, value):
+        """
+        Get the rules matching one value.
+
+        Parameters:
+        value (str): Value to match.
+
+        Returns:
+        set: Indices of the matching rules.
+        """
+        found = set(self.exact.get(value, ()))
+        if self.scan is not None:
+            lowered = value.lower()
+            for hit in self.scan.finditer(lowered):
+                start = hit.start()
+                for literal, i, case in self.hits[hit.group(1)]:
+                    if not case or value.startswith(literal, start):
+                        found.add(i)
+        found.update(i for i, regex in self.regexes if i not in found and regex.search(value))
+        return found
+
+    def __call__(self, values):
+        """
+        Match all rules against a column.
+
+        Parameters:
+        values (pd.Series): Column to match.
+
+        Returns:
+        np.ndarray: Boolean array of shape (len(values), number of rules), True where rule i matches.
+        """
+        codes, uniques = pd.factorize(values)
+        found = np.zeros((len(uniques) + 1, len(self.rules)), dtype=bool)
+        for j, value in enumerate(uniques):
+            if isinstance(value, str):
+                found[j, list(self.match_value(value))] = True
+        # Missing values have code -1, which picks the all-False last row
+        return found[codes]
+
+
+def compile_stage(rules):
+    """
+    Compile the rules of a stage into one matcher per source column.
+
+    Parameters:
+    rules (list): Rules of the stage.
+
+    Returns:
+    dict: Source column mapped to its ColumnMatcher.
+    """
+    columns = dict.fromkeys(rule['column'] for rule in rules)
+    return {column: ColumnMatcher([rule for rule in rules if rule['column'] == column]) for column in columns}
+
+
+def apply_stage(df, stage, compiled=None):
+    """
+    Apply one stage of rules to a catalog.
+
+    Parameters:
+    df (pd.DataFrame): Catalog to normalize, modified in place.
+    stage (dict): Stage with 'rules' and optional 'defaults'.
+    compiled (dict, optional): Result of compile_stage for the stage's rules.
+
+    Returns:
+    pd.DataFrame: The catalog, without rows matched by drop rules.
+    """
+    compiled = compiled or compile_stage(stage['rules'])
+    for column, value in stage.get('defaults', {}).items():
+        # A null default adds the column as missing values, to be filled by the stage's rules
+        df[column] = pd.Series(np.nan if value is None else value, index=df.index, dtype=object)
+    # Match every rule against the stage's input before anything is written
+    writes, drop = [], pd.Series(False, index=df.index)
+    for column, matcher in compiled.items():
+        if column not in df:
+            continue
+        found = matcher(df[column])
+        for i, rule in enumerate(matcher.rules):
+            mask = found[:, i]
+            if rule.get('drop'):
+                drop |= mask
+            elif mask.any():
+                writes.append((rule.get('priority', 0), rule, mask))
+    # Lower priorities are written first so the highest matching priority ends up in each cell
+    for _, rule, mask in sorted(writes, key=lambda write: write[0]):
+        types = rule.get('types', {})
+        for target, value in rule['set'].items():
+            if target in types:
+                value = _TYPES[types[target]](value)
+            df.loc[mask, target] = value
+    return df[~drop.to_numpy()] if drop.any() else df
+
+
+def apply_rules(df, stages=None, after_stage=None):
+    """
+    Apply all stages of a rule table to a catalog.
+
+    Parameters:
+    df (pd.DataFrame): Catalog to normalize, modified in place.
+    stages (list, optional): Stages as returned by load_rules. Defaults to the shipped rules.
+    after_stage (dict, optional): Stage names mapped to functions df -> df run right after that stage.
+
+    Returns:
+    pd.DataFrame: The normalized catalog.
+    """
+    stages = load_rules() if stages is None else stages
+    for stage in stages:
+        df = apply_stage(df, stage)
+        hook = (after_stage or {}).get(stage.get('name'))
+        if hook is not None:
+            df = hook(df)
+    return df
+
+
+# Chip numbers that do not follow the chip<number> naming convention, in order of precedence
+CHIPS = ['21985', '22717', '20264', '22064', '22194', '20402', '23150', '23178', '23156',
+         '23120', '23187', '23139', '22710', '23141', '23137', '23215', '23179', '23124',
+         '22542', '20215', '20380', 'p001384', '20174a', 'p001354', '20247', '25244',
+         '25136', '23117b', '23117f', '23117F', '23117d', '25126d', '25158', '25123', '23154',
+         '25126', '25122', '22064b', '22150b', '22097', '23119a', '22150a', '23196',
+         '23119', '23149']
+SUFFIX_CUTOFF = '2024-05-31'
+
+
+def extract_chip_numbers(names, chips=None):
+    """
+    Extract the chip number of each experiment name.
+
+    A 'chip<digits>' tag wins, then the earliest entry of chips found anywhere in the name, then
+    digits at the start of the name.
+
+    Parameters:
+    names (pd.Series): Experiment names.
+    chips (list, optional): Known chip numbers in order of precedence. Defaults to CHIPS.
+
+    Returns:
+    pd.Series: Chip numbers, NaN where none was found.
+    """
+    chips = list(dict.fromkeys(CHIPS if chips is None else chips))
+    names = names.astype(object)
+    tagged = names.str.extract(r'chip(\d+)', expand=False)
+    # A lookahead over the longest-first alternation reports the longest known chip starting at
+    # every position, so overlapping chips are all seen; a hit also stands for the shorter chips
+    # it starts with, and the best rank over all hits of a name wins
+    keys = sorted(chips, key=len, reverse=True)
+    rank = {key: min(i for i, chip in enumerate(chips) if key.startswith(chip)) for key in keys}
+    codes, uniques = pd.factorize(names)
+    known = pd.Series(np.nan, index=names.index, dtype=object)
+    if keys and len(uniques):
+        pattern = '(?=(' + '|'.join(map(re.escape, keys)) + '))'
+        hits = pd.Series(uniques, dtype=object).str.extractall(pattern)[0]
+        best = hits.map(rank).groupby(level=0).min()
+        first = np.full(len(uniques), np.nan, dtype=object)
+        first[best.index] = np.asarray(chips, dtype=object)[best.to_numpy()]
+        known[codes >= 0] = first[codes[codes >= 0]]
+    leading = names.str.extract(r'^(\d+)', expand=False)
+    return tagged.fillna(known).fillna(leading)
+
+
+def add_chip_numbers(df, chips=None, cutoff=SUFFIX_CUTOFF):
+    """
+    Add a chip_number column. Chips are reused across plates, so a chip number not already ending
+    in 'd' or 'e' gets 'd' when all its recordings are before cutoff and 'e' otherwise.
+
+    Parameters:
+    df (pd.DataFrame): Catalog with experiment_name and experiment_date, modified in place.
+    chips (list, optional): Known chip numbers in order of precedence. Defaults to CHIPS.
+    cutoff (str): Date separating the 'd' and 'e' plates.
+
+    Returns:
+    pd.DataFrame: The catalog with chip_number.
+    """
+    chip_number = extract_chip_numbers(df['experiment_name'], chips).fillna('unknown')
+    last_date = pd.to_datetime(df['experiment_date']).groupby(chip_number).transform('max')
+    suffix = np.where(last_date < pd.to_datetime(cutoff), 'd', 'e')
+    done = chip_number.str.endswith(('d', 'e'))
+    df['chip_number'] = chip_number.where(done, chip_number + suffix)
+    return df
+
+
+def _org_age(df):
+    df['org_age'] = df['experiment_date'] - df['agg_date']
+    return df
+
+
+def normalize_catalog(df, stages=None):
+    """
+    Normalize a raw catalog built from metadata: parse dates, compute org_age, apply the rules and
+    add chip numbers.
+
+    Parameters:
+    df (pd.DataFrame): Raw catalog with uuids, experiment_name, experiment_date, sample_type, species,
+                       cell_line, agg_date and plating_date columns.
+    stages (list, optional): Stages as returned by load_rules. Defaults to the shipped rules.
+
+    Returns:
+    pd.DataFrame: The normalized catalog.
+    """
+    df = df.copy()
+    df['experiment_date'] = pd.to_datetime(df['experiment_date'], errors='coerce')
+    df['agg_date'] = pd.to_datetime(df['agg_date'], errors='coerce')
+    # org_age depends on the corrected agg_date, so it is computed after the 'raw' stage
+    df = apply_rules(df, stages, after_stage={'raw': _org_age})
+    return add_chip_numbers(df)
@@ -0,0 +1,273 @@
+"""
+Concurrent S3 downloader for curated recordings.
+
+Objects are listed with a paginator, so prefixes with more than 1000 keys are fully covered,
+and downloaded by a bounded pool of worker threads. Files that are already present locally with
+the same size (or ETag) are skipped. Large objects are fetched as parallel ranged parts through
+boto3's TransferConfig; smaller ones are streamed into a .part file that a later run resumes with a
+ranged GET, as long as the object still has the ETag recorded next to the partial file. Failed
+transfers are retried with exponential backoff.
+"""
+import os
+import time
+import random
+import hashlib
+import boto3
+from botocore.client import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ENDPOINT_URL = 'https://s3-west.nrp-nautilus.io'
+BUCKET_NAME = 'braingeneers'
+MB = 1024 * 1024
+
+
+def local_etag(path, part_size=None, n_parts=None):
+    """
+    Compute the S3 ETag a local file would have.
+
+    Parameters:
+    path (str): Path to the local file.
+    part_size (int, optional): Part size in bytes of the multipart upload. None for a single-part upload.
+    n_parts (int, optional): Number of parts in the multipart upload, used as the ETag suffix.
+
+    Returns:
+    str: The ETag without quotes, e.g. 'md5' or 'md5-of-part-md5s-N'.
+    """
+    with open(path, 'rb') as f:
+        if part_size is None:
+            md5 = hashlib.md5()
+            for chunk in iter(lambda: f.read(MB), b''):
+                md5.update(chunk)
+            return md5.hexdigest()
+        digests = [hashlib.md5(chunk).digest() for chunk in iter(lambda: f.read(part_size), b'')]
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{n_parts or len(digests)}"
+
+
+class S3Downloader:
+    """
+    Download objects from an S3 bucket (or an S3 compatible endpoint) into a local directory.
+    """
+    def __init__(self, endpoint_url=ENDPOINT_URL, bucket_name=BUCKET_NAME, max_workers=8, check='size',
+                 multipart_threshold=64 * MB, multipart_chunksize=16 * MB, retries=3, backoff=1.0, client=None):
+        """
+        Initialize S3Downloader.
+
+        Parameters:
+        endpoint_url (str): S3 endpoint URL. None uses the AWS default.
+        bucket_name (str): Bucket to download from.
+        max_workers (int): Number of objects downloaded at the same time.
+        check (str): How existing local files are compared to the object: 'size' or 'etag'.
+        multipart_threshold (int): Objects at least this large (bytes) are downloaded as parallel ranged parts.
+        multipart_chunksize (int): Size in bytes of each ranged part.
+        retries (int): Number of retries per object after the first failed attempt.
+        backoff (float): Base delay in seconds between retries, doubled after every attempt.
+        client (botocore.client.S3, optional): Existing S3 client, e.g. one pointed at a local S3 stand-in.
+        """
+        if check not in ('size', 'etag'):
+            raise ValueError("check must be either 'size' or 'etag'")
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.check = check
+        self.retries = retries
+        self.backoff = backoff
+        self.multipart_threshold = multipart_threshold
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=4)
+        self.s3 = client or boto3.client(
+            's3', endpoint_url=endpoint_url,
+            config=Config(signature_version='s3v4', max_pool_connections=max(10, max_workers * 4))
+        )
+
+    def list_objects(self, prefix, suffix=None):
+        """
+        List all objects under a prefix, following continuation tokens.
+
+        Parameters:
+        prefix (str): Key prefix to list.
+        suffix (str, optional): Only keys ending with this suffix are returned.
+
+        Returns:
+        list: Object entries as returned by list_objects_v2 (Key, Size, ETag, ...).
+        """
+        paginator = self.s3.get_paginator('list_objects_v2')
+        objects = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            objects.extend(obj for obj in page.get('Contents', [])
+                           if suffix is None or obj['Key'].endswith(suffix))
+        return objects
+
+    def is_current(self, obj, local_path):
+        """
+        Check whether a local file already holds an object.
+
+        Parameters:
+        obj (dict): Object entry with Size and ETag.
+        local_path (str): Path of the local file.
+
+        Returns:
+        bool: True if the file exists and matches the object's size (and ETag when check='etag').
+        """
+        if not os.path.exists(local_path) or os.path.getsize(local_path) != obj['Size']:
+            return False
+        if self.check == 'size':
+            return True
+        etag = obj['ETag'].strip('"')
+        if '-' not in etag:
+            return local_etag(local_path) == etag
+        # Multipart ETags depend on the upload part size, so try the usual candidates
+        n_parts = int(etag.split('-')[1])
+        per_part = -(-obj['Size'] // n_parts)
+        candidates = {self.transfer_config.multipart_chunksize, 8 * MB, -(-per_part // MB) * MB}
+        return any(local_etag(local_path, size, n_parts) == etag for size in candidates
+                   if -(-obj['Size'] // size) == n_parts)
+
+    def _fetch(self, obj, part_path):
+        """
+        Download an object into part_path, resuming a partial file of a streamed download.
+        The ETag of the object a partial file came from is kept in a .etag file next to it, so
+        a partial file of an older version of the object is discarded instead of resumed.
+        """
+        key, size = obj['Key'], obj['Size']
+        etag_path = part_path + '.etag'
+        have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if have:
+            stored = None
+            if os.path.exists(etag_path):
+                with open(etag_path, 'r') as f:
+                    stored = f.read()
+            if have > size or stored != obj['ETag']:
+                os.remove(part_path)
+                have = 0
+        if size >= self.multipart_threshold:
+            self.s3.download_file(self.bucket_name, key, part_path, Config=self.transfer_config)
+            return
+        if have == size:
+            return
+        response = None
+        if have:
+            # Continue where the last attempt stopped, as long as the object did not change
+            try:
+                response = self.s3.get_object(Bucket=self.bucket_name, Key=key, Range=f'bytes={have}-',
+                                              IfMatch=obj['ETag'])
+            except ClientError as e:
+                if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 412:
+                    raise
+                # The object changed since the partial file was written, so start over
+                os.remove(part_path)
+                have = 0
+        if not have:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=key)
+            with open(etag_path, 'w') as f:
+                f.write(response['ETag'])
+        with open(part_path, 'ab' if have else 'wb') as f:
+            for chunk in response['Body'].iter_chunks(MB):
+                f.write(chunk)
+
+    def download_object(self, obj, local_path, force=False):
+        """
+        Download one object unless the local file is already current, retrying with backoff.
+
+        Parameters:
+        obj (dict): Object entry with Key, Size and ETag.
+        local_path (str): Destination path. Parent directories are created as needed.
+        force (bool): Download even if the local file looks current, e.g. when the ETag is known to differ.
+
+        Returns:
+        str: 'skipped' if the file was current, 'downloaded' otherwise.
+        """
+        if not force and self.is_current(obj, local_path):
+            return 'skipped'
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+        part_path = local_path + '.part'
+        for attempt in range(self.retries + 1):
+            try:
+                self._fetch(obj, part_path)
+                if os.path.getsize(part_path) != obj['Size']:
+                    raise IOError(f"Incomplete download of {obj['Key']}")
+                os.replace(part_path, local_path)
+                if os.path.exists(part_path + '.etag'):
+                    os.remove(part_path + '.etag')
+                return 'downloaded'
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def download(self, jobs, progress=print, force=False):
+        """
+        Download several objects concurrently.
+
+        Parameters:
+        jobs (list): (object entry, local path) pairs.
+        progress (callable, optional): Called with one message per finished object. None to disable.
+        force (bool): Download every object, without checking the local files first.
+
+        Returns:
+        dict: 'downloaded' and 'skipped' lists of keys, and 'failed' mapping keys to error messages.
+        """
+        results = {'downloaded': [], 'skipped': [], 'failed': {}}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.download_object, obj, path, force): (obj['Key'], path) for obj, path in jobs}
+            for future in as_completed(futures):
+                key, path = futures[future]
+                try:
+                    status = future.result()
+                except Exception as e:
+                    results['failed'][key] = str(e)
+                    message = f"Error downloading {key}: {str(e)}"
+                else:
+                    results[status].append(key)
+                    message = f"Downloaded {key} to {path}" if status == 'downloaded' else f"Up to date: {path}"
+                if progress is not None:
+                    progress(message)
+        return results
+
+    def download_prefix(self, prefix, local_directory, suffix=None, progress=print):
+        """
+        Download every object under a prefix, keeping the key layout below the prefix.
+
+        Parameters:
+        prefix (str): Key prefix to download.
+        local_directory (str): Directory the objects are written to.
+        suffix (str, optional): Only keys ending with this suffix are downloaded.
+        progress (callable, optional): Called with one message per finished object.
+
+        Returns:
+        dict: Result lists, see download.
+        """
+        jobs = [(obj, os.path.join(local_directory, os.path.relpath(obj['Key'], prefix)))
+                for obj in self.list_objects(prefix, suffix)]
+        return self.download(jobs, progress)
+
+
+def download_s3_files(endpoint_url, bucket_name, uuids, local_directory,
+                      prefix_template="ephys/{uuid}/derived/autocuration/", suffix=None, **kwargs):
+    """
+    Download the curated files of several uuids into local_directory/<uuid>/.
+
+    Parameters:
+    endpoint_url (str): S3 endpoint URL.
+    bucket_name (str): Bucket to download from.
+    uuids (list): UUIDs of the experiments to download.
+    local_directory (str): Existing directory the files are written to.
+    prefix_template (str): Key prefix of each uuid, formatted with uuid.
+    suffix (str, optional): Only keys ending with this suffix are downloaded, e.g. '_acqm.zip'.
+    **kwargs: Passed to S3Downloader, e.g. max_workers or check='etag'.
+
+    Returns:
+    dict: 'downloaded' and 'skipped' lists of keys, and 'failed' mapping keys to error messages.
+    """
+    assert os.path.exists(local_directory), f"Local directory {local_directory} does not exist!"
+    downloader = S3Downloader(endpoint_url, bucket_name, **kwargs)
+    jobs = []
+    for uuid in uuids:
+        prefix = prefix_template.format(uuid=uuid)
+        jobs.extend((obj, os.path.join(local_directory, uuid, os.path.relpath(obj['Key'], prefix)))
+                    for obj in downloader.list_objects(prefix, suffix))
+    results = downloader.download(jobs)
+    print(f"Download complete! {len(results['downloaded'])} downloaded, {len(results['skipped'])} up to date, "
+          f"{len(results['failed'])} failed")
+    return results
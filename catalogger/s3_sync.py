@@ -0,0 +1,337 @@
+"""
+Incremental sync of curated acqm files from S3 into basepath, driven by the catalog.
+
+A manifest (JSON, stored under basepath by default) records the key, ETag, size and local path of
+every synced object. Each run lists the prefixes of the catalog's uuids, downloads only objects that
+are new or whose ETag/size changed, and reports the catalog rows affected so only those are
+reprocessed. Run with:
+    python -m catalogger.s3_sync catalog_baseline.csv /path/to/basepath
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .s3_downloader import S3Downloader, ENDPOINT_URL, BUCKET_NAME
+
+# Earlier prefixes win when two of them hold a file with the same name
+PREFIX_TEMPLATES = ('ephys/{uuid}/derived/kilosort2', 'ephys/{uuid}/derived/autocuration/')
+MANIFEST_NAME = '.catalogger_manifest.json'
+
+
+def load_manifest(path):
+    """
+    Load a sync manifest.
+
+    Parameters:
+    path (str): Path to the manifest file.
+
+    Returns:
+    dict: Keys mapped to {'etag', 'size', 'local_path', 'synced_at'}. Empty if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """
+    Write a sync manifest, replacing the old file only once the new one is complete.
+
+    Parameters:
+    manifest (dict): Manifest entries, see load_manifest.
+    path (str): Path to the manifest file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def plan(downloader, uuids, local_directory, manifest, prefix_templates=PREFIX_TEMPLATES, suffix='_acqm.zip'):
+    """
+    List the remote objects of the uuids and compare them to the manifest.
+
+    Parameters:
+    downloader (S3Downloader): Downloader used for listing.
+    uuids (iterable): UUIDs to sync.
+    local_directory (str): Base directory the files are synced into (basepath).
+    manifest (dict): Current manifest entries.
+    prefix_templates (tuple): Key prefixes of each uuid, formatted with uuid.
+    suffix (str): Only keys ending with this suffix are synced.
+
+    Returns:
+    tuple: (changed, current, removed)
+        changed (list): (object entry, local path) pairs to download.
+        current (list): (object entry, local path) pairs that are already up to date.
+        removed (list): Manifest keys under the listed prefixes that no longer exist remotely.
+    """
+    changed, current, listed, seen_paths = [], [], set(), set()
+    prefixes = []
+    for uuid in uuids:
+        for template in prefix_templates:
+            prefix = template.format(uuid=uuid)
+            prefixes.append(prefix)
+            for obj in downloader.list_objects(prefix, suffix):
+                local_path = os.path.join(local_directory, uuid, os.path.relpath(obj['Key'], prefix))
+                if local_path in seen_paths:
+                    continue
+                seen_paths.add(local_path)
+                listed.add(obj['Key'])
+                entry = manifest.get(obj['Key'])
+                if entry is not None:
+                    # Known object: compare ETags instead of hashing the local file
+                    up_to_date = (entry['etag'] == obj['ETag'] and entry['size'] == obj['Size']
+                                  and os.path.exists(local_path) and os.path.getsize(local_path) == obj['Size'])
+                else:
+                    up_to_date = downloader.is_current(obj, local_path)
+                (current if up_to_date else changed).append((obj, local_path))
+    removed = [key for key in manifest if key not in listed and key.startswith(tuple(prefixes))]
+    return changed, current, removed
+
+
+def affected_rows(catalog, local_paths, local_directory):
+    """
+    Find the catalog rows whose acqm file is one of the given local files.
+
+    Parameters:
+    catalog (pd.DataFrame): Catalog with uuids and experiment_name columns.
+    local_paths (iterable): Paths of files that were downloaded or removed.
+    local_directory (str): Base directory the files are synced into (basepath).
+
+    Returns:
+    pd.Series: Boolean mask over the catalog.
+    """
+    files = {}
+    for path in local_paths:
+        uuid = os.path.relpath(path, local_directory).split(os.sep)[0]
+        files.setdefault(uuid, []).append(os.path.basename(path))
+    return pd.Series([any(name == row_name or name.startswith(row_name + '_') for name in files.get(uuid, []))
+                      for uuid, row_name in zip(catalog['uuids'], catalog['experiment_name'])],
+                     index=catalog.index)
+
+
+def mark_stale(catalog, mask):
+    """
+    Mark catalog rows for reprocessing. Their stored metric versions and data objects are cleared,
+    so the next update_catalog reloads exactly these rows from disk and keeps the values of all others.
+
+    Parameters:
+    catalog (pd.DataFrame): Processed catalog, updated in place.
+    mask (pd.Series or list): Boolean mask, or experiment names of the rows to mark.
+
+    Returns:
+    pd.DataFrame: The catalog.
+    """
+    if not isinstance(mask, pd.Series) or mask.dtype != bool:
+        mask = catalog['experiment_name'].isin(list(mask))
+    if 'metric_versions' in catalog:
+        catalog.loc[mask, 'metric_versions'] = None
+    if 'processed' in catalog:
+        catalog.loc[mask, 'processed'] = False
+    if 'data_obj' in catalog:
+        catalog.loc[mask, 'data_obj'] = None
+    return catalog
+
+
+def sync(catalog, local_directory, endpoint_url=ENDPOINT_URL, bucket_name=BUCKET_NAME, manifest_path=None,
+         prefix_templates=PREFIX_TEMPLATES, suffix='_acqm.zip', downloader=None, progress=print, **kwargs):
+    """
+    Bring basepath up to date with the acqm files of every uuid in the catalog.
+
+    Parameters:
+    catalog (pd.DataFrame or str): Catalog, or path to a catalog CSV such as catalog_baseline.csv.
+    local_directory (str): Base directory the files are synced into (basepath).
+    endpoint_url (str): S3 endpoint URL.
+    bucket_name (str): Bucket to sync from.
+    manifest_path (str, optional): Manifest file. Defaults to a file inside local_directory.
+    prefix_templates (tuple): Key prefixes of each uuid, formatted with uuid.
+    suffix (str): Only keys ending with this suffix are synced.
+    downloader (S3Downloader, optional): Existing downloader. Otherwise one is created with **kwargs.
+    progress (callable, optional): Called with one message per downloaded object. None to disable.
+
+    Returns:
+    dict: 'downloaded', 'skipped' and 'removed' lists of keys, 'failed' mapping keys to errors,
+          and 'affected' with the experiment names whose files changed.
+    """
+    if isinstance(catalog, str):
+        catalog = pd.read_csv(catalog)
+    if not os.path.exists(local_directory):
+        raise ValueError(f"Local directory {local_directory} does not exist!")
+    manifest_path = manifest_path or os.path.join(local_directory, MANIFEST_NAME)
+    downloader = downloader or S3Downloader(endpoint_url, bucket_name, **kwargs)
+    manifest = load_manifest(manifest_path)
+
+    changed, current, removed = plan(downloader, catalog['uuids'].dropna().unique(), local_directory,
+                                     manifest, prefix_templates, suffix)
+    # Changed objects may keep their size, so the local size check is bypassed
+    results = downloader.download(changed, progress, force=True) if changed else {'downloaded': [], 'skipped': [], 'failed': {}}
+    results['skipped'] = results['skipped'] + [obj['Key'] for obj, _ in current]
+    return _finish(catalog, local_directory, manifest, manifest_path, changed, current, removed, results)
+
+
+def _finish(catalog, local_directory, manifest, manifest_path, changed, current, removed, results):
+    """
+    Record a sync in the manifest and work out which catalog rows it affected.
+    """
+    now = time.strftime('%Y-%m-%dT%H:%M:%S')
+    done = set(results['downloaded'])
+    for obj, local_path in changed + current:
+        if obj['Key'] in done or obj['Key'] not in manifest:
+            if obj['Key'] not in results['failed']:
+                manifest[obj['Key']] = {'etag': obj['ETag'], 'size': obj['Size'],
+                                        'local_path': os.path.relpath(local_path, local_directory), 'synced_at': now}
+    removed_paths = [os.path.join(local_directory, manifest.pop(key)['local_path']) for key in removed]
+    results['removed'] = removed
+    save_manifest(manifest, manifest_path)
+
+    touched = [path for obj, path in changed if obj['Key'] in done] + removed_paths
+    mask = affected_rows(catalog, touched, local_directory)
+    results['affected'] = catalog.loc[mask, 'experiment_name'].tolist()
+    print(f"Sync complete! {len(results['downloaded'])} downloaded, {len(results['skipped'])} up to date, "
+          f"{len(results['failed'])} failed, {len(removed)} removed remotely; "
+          f"{len(results['affected'])} catalog rows to reprocess")
+    return results
+
+
+class _Arrivals:
+    """
+    Iterable over the local paths of downloads as they finish, fed through a bounded queue.
+    Download workers block on a full queue, so downloads never run far ahead of processing.
+    """
+    def __init__(self, paths, queue_size):
+        self.paths = set(paths)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.expected = len(self.paths)
+
+    def put(self, path):
+        self.queue.put(path)
+
+    def __iter__(self):
+        for _ in range(self.expected):
+            path = self.queue.get()
+            if path is not None:
+                yield path
+
+    def drain(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+def sync_and_update(loader, endpoint_url=ENDPOINT_URL, bucket_name=BUCKET_NAME, manifest_path=None,
+                    prefix_templates=PREFIX_TEMPLATES, key_suffix='_acqm.zip', queue_size=4, downloader=None,
+                    progress=print, download_kwargs=None, **update_kwargs):
+    """
+    Sync the loader's basepath from S3 and update its catalog in one pipeline. Each downloaded acqm
+    file is handed to the catalog update through a bounded queue as soon as it lands, so downloading
+    and metric computation overlap instead of running one after the other.
+
+    Parameters:
+    loader (AcqmLoader): Loader with basepath and catalog set.
+    endpoint_url (str): S3 endpoint URL.
+    bucket_name (str): Bucket to sync from.
+    manifest_path (str, optional): Manifest file. Defaults to a file inside basepath.
+    prefix_templates (tuple): Key prefixes of each uuid, formatted with uuid.
+    key_suffix (str): Only keys ending with this suffix are synced.
+    queue_size (int): Maximum number of downloaded files waiting to be processed.
+    downloader (S3Downloader, optional): Existing downloader.
+    progress (callable, optional): Called with one message per downloaded object. None to disable.
+    download_kwargs (dict, optional): Passed to S3Downloader when no downloader is given, e.g. max_workers.
+    **update_kwargs: Catalog update options as for loader.update_catalog, e.g. gen_metrics=True or n_jobs=-1.
+
+    Returns:
+    dict: Sync results, see sync. The updated catalog is in loader.catalog.
+    """
+    # Imported here so the sync helpers do not need braingeneers
+    from .Loaders import CatalogUpdate
+    if loader.catalog is None or loader.basepath is None:
+        raise ValueError("basepath and catalog must be set for this operation.")
+    local_directory = loader.basepath
+    manifest_path = manifest_path or os.path.join(local_directory, MANIFEST_NAME)
+    downloader = downloader or S3Downloader(endpoint_url, bucket_name, **(download_kwargs or {}))
+    manifest = load_manifest(manifest_path)
+    catalog = loader.catalog
+    changed, current, removed = plan(downloader, catalog['uuids'].dropna().unique(), local_directory,
+                                     manifest, prefix_templates, key_suffix)
+
+    update = CatalogUpdate(catalog, local_directory, units=loader.units, **update_kwargs)
+    # Rows whose file is still being downloaded wait for it instead of being read now (or reported missing)
+    arrivals = _Arrivals([path for _, path in changed], queue_size)
+    expected = {os.path.abspath(path) for path in arrivals.paths}
+    awaiting = {os.path.abspath(zip_path): idx for idx, zip_path in update.zips.items()
+                if os.path.abspath(zip_path) in expected or not os.path.exists(update.jobs[idx])}
+    results = {'downloaded': [], 'skipped': [obj['Key'] for obj, _ in current], 'failed': {}}
+
+    def fetch(obj, local_path):
+        # Every job puts exactly one entry, so the consumer knows when all downloads are done
+        try:
+            downloader.download_object(obj, local_path, force=True)
+        except Exception as e:
+            results['failed'][obj['Key']] = str(e)
+            message, local_path = f"Error downloading {obj['Key']}: {str(e)}", None
+        else:
+            results['downloaded'].append(obj['Key'])
+            message = f"Downloaded {obj['Key']} to {local_path}"
+        if progress is not None:
+            progress(message)
+        arrivals.put(local_path)
+
+    pool = ThreadPoolExecutor(max_workers=downloader.max_workers)
+    futures = [pool.submit(fetch, obj, path) for obj, path in changed]
+    try:
+        update.schedule_rows(skip=set(awaiting.values()))
+        update.dispatch()
+        # Each downloaded file is processed as soon as it lands, with any stored values for its row discarded
+        for path in arrivals:
+            idx = awaiting.pop(os.path.abspath(path), None)
+            if idx is not None:
+                update.arrived(idx)
+                update.dispatch()
+        # Rows whose download failed or never started are read as they are on disk
+        for idx in awaiting.values():
+            update.schedule(idx, update.catalog.loc[idx])
+        update.dispatch()
+        update.wait()
+    finally:
+        update.close()
+        for future in futures:
+            future.cancel()
+        # Unblock workers still waiting on a full queue if the update stopped early
+        while not all(future.done() for future in futures):
+            arrivals.drain()
+            time.sleep(0.05)
+        pool.shutdown()
+
+    updated = update.finish()
+    if update.unit_format == 'table':
+        updated, loader.units = updated
+    loader.catalog = updated
+    return _finish(catalog, local_directory, manifest, manifest_path, changed, current, removed, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync acqm files of the catalog's uuids from S3 into basepath.")
+    parser.add_argument('catalog', help="Catalog CSV, e.g. catalog_baseline.csv.")
+    parser.add_argument('basepath', help="Local base directory the files are synced into.")
+    parser.add_argument('--endpoint', default=ENDPOINT_URL, help="S3 endpoint URL.")
+    parser.add_argument('--bucket', default=BUCKET_NAME, help="Bucket to sync from.")
+    parser.add_argument('--manifest', default=None, help="Manifest file. Defaults to one inside basepath.")
+    parser.add_argument('--suffix', default='_acqm.zip', help="Suffix of the files to sync.")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent downloads.")
+    parser.add_argument('--affected', default=None, help="Write the experiment names to reprocess to this file.")
+    args = parser.parse_args()
+    results = sync(args.catalog, args.basepath, args.endpoint, args.bucket, args.manifest,
+                   suffix=args.suffix, max_workers=args.workers)
+    if args.affected:
+        with open(args.affected, 'w') as f:
+            f.write('\n'.join(results['affected']))
+
+
+if __name__ == '__main__':
+    main()
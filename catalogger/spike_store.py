@@ -0,0 +1,249 @@
+"""
+Compact columnar store for curated spike trains.
+
+A store is a directory written next to an acqm zip (<name>_acqm.spikes for <name>_acqm.zip) with:
+    times.npy        all spike times in ms, concatenated unit after unit (float64)
+    offsets.npy      unit boundaries into times.npy, length num_units + 1 (int64)
+    meta.json        fs, unit ids, format version and the fingerprint of the source acqm file
+    neuron_data.pkl  neuron metadata and config, only read when requested
+
+times.npy and offsets.npy are memory-mapped on load, so reading a recording needs no zip
+extraction and no unpickling. Convert a data directory with:
+    python -m catalogger.spike_store /path/to/basepath
+"""
+import os
+import json
+import shutil
+import pickle
+import zipfile
+import tempfile
+import argparse
+import numpy as np
+from . import mapped_zip
+
+FORMAT_VERSION = 1
+STORE_SUFFIX = '.spikes'
+
+
+def store_path(acqm_path):
+    """
+    Get the store directory that belongs to an acqm zip file.
+
+    Parameters:
+    acqm_path (str): Path to the acqm zip file.
+
+    Returns:
+    str: Path of the store directory.
+    """
+    root, ext = os.path.splitext(acqm_path)
+    return (root if ext == '.zip' else acqm_path) + STORE_SUFFIX
+
+
+def is_store(path):
+    """
+    Check whether a path is a spike store directory.
+    """
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def resolve(acqm_path):
+    """
+    Pick the file to read for a recording. The store is preferred when it exists and was
+    converted from the current version of the acqm file (or the acqm file is gone).
+
+    Parameters:
+    acqm_path (str): Path to the acqm zip file.
+
+    Returns:
+    str or None: Store directory, acqm path, or None if neither exists.
+    """
+    store = store_path(acqm_path)
+    has_zip = os.path.exists(acqm_path)
+    if is_store(store) and (not has_zip or is_current(store, acqm_path)):
+        return store
+    return acqm_path if has_zip else None
+
+
+def is_current(store_dir, acqm_path):
+    """
+    Check whether a store was converted from the current version of an acqm file.
+
+    Parameters:
+    store_dir (str): Store directory.
+    acqm_path (str): Path to the acqm zip file, which must exist.
+
+    Returns:
+    bool: True if the store exists and its source fingerprint matches the file.
+    """
+    if not is_store(store_dir):
+        return False
+    source = read_meta(store_dir).get('source', {})
+    st = os.stat(acqm_path)
+    return source.get('size') == st.st_size and source.get('mtime_ns') == st.st_mtime_ns
+
+
+def write_store(out_dir, train, fs, neuron_data=None, config=None, units=None, source=None):
+    """
+    Write spike trains to a store directory. The files are written into a temporary directory next to
+    out_dir that is then renamed into place, so an existing store is replaced as a whole and readers
+    never see new spike arrays next to old metadata.
+
+    Parameters:
+    out_dir (str): Directory to write. Replaced if it already exists.
+    train (list): List of spike time arrays in ms, one per unit.
+    fs (float): Sampling frequency.
+    neuron_data (dict, optional): Neuron metadata.
+    config (dict, optional): Curation configuration.
+    units (list, optional): Unit ids in the same order as train.
+    source (dict, optional): Fingerprint of the source file (name, size, mtime_ns).
+
+    Returns:
+    str: The store directory.
+    """
+    if fs is None or not np.isfinite(fs):
+        raise ValueError(f"fs must be a finite sampling frequency, got {fs}.")
+    target = os.path.abspath(out_dir)
+    parent = os.path.dirname(target)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.' + os.path.basename(target) + '.', suffix='.tmp')
+    old_dir = tmp_dir + '.old'
+    try:
+        os.chmod(tmp_dir, 0o755)
+        lengths = [len(t) for t in train]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        times = np.concatenate(train).astype(np.float64) if train else np.zeros(0)
+        np.save(os.path.join(tmp_dir, 'times.npy'), times)
+        np.save(os.path.join(tmp_dir, 'offsets.npy'), offsets)
+        with open(os.path.join(tmp_dir, 'neuron_data.pkl'), 'wb') as f:
+            pickle.dump({'neuron_data': neuron_data, 'config': config}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'fs': float(fs),
+            'num_units': len(train),
+            'units': [u.item() if hasattr(u, 'item') else u for u in (units if units is not None else range(len(train)))],
+            'source': source or {},
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        # A directory cannot be renamed over a non-empty one, so the old store is moved aside first.
+        # Memory maps of its arrays stay valid until they are closed.
+        if os.path.exists(target):
+            os.rename(target, old_dir)
+        os.rename(tmp_dir, target)
+    except Exception:
+        if os.path.exists(old_dir) and not os.path.exists(target):
+            os.rename(old_dir, target)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return out_dir
+
+
+def convert_acqm(acqm_path, out_dir=None, overwrite=False):
+    """
+    Convert an acqm zip file into a spike store.
+
+    Parameters:
+    acqm_path (str): Path to the acqm zip file.
+    out_dir (str, optional): Store directory. Defaults to store_path(acqm_path).
+    overwrite (bool): Rewrite the store even if it is already up to date.
+
+    Returns:
+    str: The store directory.
+    """
+    out_dir = out_dir or store_path(acqm_path)
+    if not overwrite and is_current(out_dir, acqm_path):
+        return out_dir
+    with zipfile.ZipFile(acqm_path, 'r') as f_zip:
+        data = mapped_zip.open_npz(f_zip, acqm_path, "qm.npz")
+        spike_times = data["train"].item()
+        fs = data["fs"]
+        train = [(times / fs) * 1000 for times in spike_times.values()]
+        config = data["config"].item() if "config" in data else None
+        neuron_data = data["neuron_data"].item()
+    st = os.stat(acqm_path)
+    source = {'name': os.path.basename(acqm_path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    return write_store(out_dir, train, fs, neuron_data, config, list(spike_times.keys()), source)
+
+
+def read_meta(store_dir):
+    """
+    Read the metadata of a store without touching the spike arrays.
+
+    Parameters:
+    store_dir (str): Store directory.
+
+    Returns:
+    dict: Store metadata (fs, num_units, units, format_version, source).
+    """
+    with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def load_store(store_dir, mmap=True, load_neuron_data=True):
+    """
+    Load spike trains from a store directory.
+
+    Parameters:
+    store_dir (str): Store directory.
+    mmap (bool): Memory-map the spike arrays instead of reading them into memory.
+    load_neuron_data (bool): Whether to read neuron metadata and config.
+
+    Returns:
+    tuple: (train, neuron_data, config, fs)
+        train (list): Spike time arrays in ms, views into the concatenated times array.
+        neuron_data (dict or None): Neuron metadata.
+        config (dict or None): Configuration dictionary if present.
+        fs (float): Sampling frequency.
+    """
+    meta = read_meta(store_dir)
+    mmap_mode = 'r' if mmap else None
+    times = np.load(os.path.join(store_dir, 'times.npy'), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(store_dir, 'offsets.npy'))
+    train = [times[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    neuron_data, config = None, None
+    if load_neuron_data:
+        with open(os.path.join(store_dir, 'neuron_data.pkl'), 'rb') as f:
+            extra = pickle.load(f)
+        neuron_data, config = extra['neuron_data'], extra['config']
+    return train, neuron_data, config, meta['fs']
+
+
+def convert_tree(basepath, suffix='_acqm.zip', overwrite=False):
+    """
+    Convert every acqm zip file under basepath into a spike store next to it.
+
+    Parameters:
+    basepath (str): Base directory where data is stored.
+    suffix (str): Only files ending with this suffix are converted.
+    overwrite (bool): Rewrite stores even if they are up to date.
+
+    Returns:
+    list: Store directories that were written or already up to date.
+    """
+    stores = []
+    for root, _, files in os.walk(basepath):
+        for name in sorted(files):
+            if not name.endswith(suffix):
+                continue
+            acqm_path = os.path.join(root, name)
+            try:
+                stores.append(convert_acqm(acqm_path, overwrite=overwrite))
+                print(f"Converted: {acqm_path}")
+            except Exception as e:
+                print(f"Error converting {acqm_path}: {str(e)}")
+    return stores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert acqm zip files into memory-mappable spike stores.")
+    parser.add_argument('basepath', help="Base directory to scan for acqm files.")
+    parser.add_argument('--suffix', default='_acqm.zip', help="Suffix of the files to convert.")
+    parser.add_argument('--overwrite', action='store_true', help="Rewrite stores that are already up to date.")
+    args = parser.parse_args()
+    stores = convert_tree(args.basepath, args.suffix, args.overwrite)
+    print(f"{len(stores)} spike stores under {args.basepath}")
+
+
+if __name__ == '__main__':
+    main()
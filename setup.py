@@ -14,6 +14,7 @@ setup(
     long_description_content_type="text/markdown",
     url="git@github.com:hschweiger15/Catalogger.git",
     packages=find_packages(),
+    package_data={"catalogger": ["*.json"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,67 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+
+pytest.importorskip('braingeneers')
+
+from catalogger.Loaders import DrugLoader, STITCH_INDEX_NAME
+
+RATE = 10000
+
+
+def write_stitch_file(path, minutes):
+    path.write_text(json.dumps([[i, RATE * 60 * m] for i, m in enumerate(minutes)]))
+
+
+def test_stitch_files_added_after_index_are_found_concurrently(tmp_path):
+    (tmp_path / 'u0').mkdir()
+    (tmp_path / 'u0' / 'metadata.json').write_text(json.dumps({'ephys_experiments': {'base': {'sample_rate': RATE}}}))
+    loader = DrugLoader(str(tmp_path))
+    loader.build_stitch_index()
+    drugs = [f'drug{i}' for i in range(16)]
+    for i, drug in enumerate(drugs):
+        write_stitch_file(tmp_path / 'u0' / f'{drug}_stitch_inds.json', [1, 2 + i, 3 + i])
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        windows = list(pool.map(lambda drug: loader.get_windows(drug, 'u0'), drugs))
+
+    for i, drug_windows in enumerate(windows):
+        assert drug_windows['incubated'] == ((2 + i) * 60000, (3 + i) * 60000)
+    saved = json.loads((tmp_path / STITCH_INDEX_NAME).read_text())
+    assert sorted(saved) == sorted(f'u0/{drug}_stitch_inds.json' for drug in drugs)
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == '.tmp'] == []
+
+
+WINDOWS = {
+    'whole': (None, None),
+    'from_zero': (0, 250.0),
+    'inner': (100.0, 400.0),
+    'negative': (-300.0, -100.0),
+    'open_end': (800.0, None),
+    'past_end': (900.0, 5000.0),
+    'after_end': (2000.0, 3000.0),
+    'reversed': (600.0, 300.0),
+    'empty': (300.0, 300.0),
+}
+
+
+@pytest.mark.parametrize('phase', list(WINDOWS))
+def test_split_phases_matches_subtime(phase):
+    spikedata = pytest.importorskip('spikedata.spikedata')
+    rng = np.random.default_rng(0)
+    train = [np.sort(np.concatenate([rng.uniform(0, 1000, 300), [0.0, 100.0, 250.0, 400.0, 1000.0]]))
+             for _ in range(4)] + [np.array([])]
+    raw_time = np.arange(0, 1000.5, 0.5)
+    sd = spikedata.SpikeData(train, length=1000.0, metadata={'fs': 20000.0},
+                             raw_time=raw_time, raw_data=rng.normal(size=(2, len(raw_time))))
+
+    split = DrugLoader().split_phases(sd, WINDOWS)[phase]
+    expected = sd.subtime(*WINDOWS[phase])
+    assert split.length == expected.length
+    assert split.N == expected.N and split.metadata == expected.metadata
+    assert len(split.train) == len(expected.train)
+    for got, want in zip(split.train, expected.train):
+        np.testing.assert_array_equal(got, want)
+    np.testing.assert_array_equal(split.raw_time, expected.raw_time)
+    np.testing.assert_array_equal(split.raw_data, expected.raw_data)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from catalogger.metrics import batch_metrics, recording_values
+
+spikedata = pytest.importorskip('spikedata.spikedata')
+
+
+def random_recording(rng, num_units, length):
+    return [np.sort(rng.uniform(0, length, rng.integers(0, 200))) for _ in range(num_units)]
+
+
+def recordings():
+    rng = np.random.default_rng(0)
+    recs = [random_recording(rng, n, length) for n, length in [(1, 1000), (5, 60000), (30, 123456.7), (12, 999)]]
+    # Bursts, spikes at t=0, empty units and a unit with a single spike
+    recs.append([np.array([0.0, 0.0, 1.0, 2.0, 3.0, 500.0]), np.array([]), np.array([0.0]),
+                 np.array([40.0, 40.0, 80.0, 80.5])])
+    # Spikes exactly on bin edges
+    recs.append([np.arange(0, 4001, 40.0), np.arange(20, 4000, 80.0)])
+    return recs
+
+
+def reference(train, length, bin_size=40):
+    # The formulas of the per-recording catalog update, on a real SpikeData
+    sd = spikedata.SpikeData(train, length=length)
+    firing_rates = [(len(t) / sd.length) * 1000 for t in train]
+    return {
+        'firing_rates': firing_rates,
+        'mean_firing_rate': np.mean(firing_rates),
+        'median_firing_rate': np.median(firing_rates),
+        'burstiness': sd.burstiness_index(bin_size),
+    }
+
+
+@pytest.mark.parametrize('given_lengths', [False, True])
+@pytest.mark.parametrize('bin_size', [40, 7.5])
+def test_batch_metrics_match_spikedata(given_lengths, bin_size):
+    recs = recordings()
+    rng = np.random.default_rng(1)
+    lengths = [max(max((t[-1] for t in rec if len(t)), default=0) + rng.uniform(0, 500), 1) for rec in recs]
+    batch = batch_metrics(recs, lengths=lengths if given_lengths else None, bin_size=bin_size)
+    for i, rec in enumerate(recs):
+        # Without lengths, SpikeData also defaults to the last spike time
+        expected = reference(rec, lengths[i] if given_lengths else None, bin_size)
+        values = recording_values(batch, i)
+        np.testing.assert_allclose(values['firing_rates'], expected['firing_rates'], rtol=1e-12)
+        for name in ('mean_firing_rate', 'median_firing_rate', 'burstiness'):
+            assert values[name] == pytest.approx(expected[name], rel=1e-12), name
+
+
+def test_batch_metrics_zero_length_recording():
+    batch = batch_metrics([[np.array([]), np.array([])], [np.array([0.0, 10.0])]], lengths=[0.0, 100.0])
+    sd = spikedata.SpikeData([np.array([]), np.array([])], length=0.0)
+    assert recording_values(batch, 0)['burstiness'] == sd.burstiness_index() == 1.0
+    assert recording_values(batch, 1)['burstiness'] == pytest.approx(reference([np.array([0.0, 10.0])], 100.0)['burstiness'])
+
+
+def test_batch_metrics_recording_without_units():
+    batch = batch_metrics([[], [np.array([1.0, 2.0])]], lengths=[100.0, 100.0])
+    values = recording_values(batch, 0)
+    assert values['firing_rates'] == []
+    assert np.isnan(values['mean_firing_rate']) and np.isnan(values['median_firing_rate'])
+    assert recording_values(batch, 1)['mean_firing_rate'] == pytest.approx(20.0)
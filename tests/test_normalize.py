@@ -0,0 +1,36 @@
+import io
+import os
+import pandas as pd
+import pytest
+
+from catalogger.normalize import normalize_catalog, extract_chip_numbers
+
+BASELINE = os.path.join(os.path.dirname(__file__), os.pardir, 'catalog_baseline.csv')
+RAW_COLUMNS = ['uuids', 'experiment_name', 'experiment_date', 'sample_type', 'species', 'cell_line',
+               'agg_date', 'plating_date']
+
+
+def read_catalog(source):
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+@pytest.fixture
+def baseline():
+    return read_catalog(BASELINE)
+
+
+def test_normalize_reproduces_baseline(baseline):
+    # The raw columns are what the metadata provides; every other column is derived by the rules
+    normalized = normalize_catalog(baseline[RAW_COLUMNS])
+    written = read_catalog(io.StringIO(normalized.to_csv(index=False)))
+    assert list(written.columns) == list(baseline.columns)
+    for column in baseline.columns:
+        pd.testing.assert_series_equal(written[column], baseline[column], check_names=False, obj=column)
+
+
+def test_extract_chip_numbers_precedence():
+    names = pd.Series(['chip123_22064b', 'Trace_22064b_x', 'x_2121_y', '20247_day2', 'none', None])
+    chips = extract_chip_numbers(names, ['121', '22064', '22064b', '212'])
+    # '212' starts before '121' in 'x_2121_y', but '121' comes first in the list
+    assert chips.iloc[:4].tolist() == ['123', '22064', '121', '20247']
+    assert chips.iloc[4:].isna().all()
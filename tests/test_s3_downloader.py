@@ -0,0 +1,186 @@
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from catalogger import s3_downloader
+from catalogger.s3_downloader import S3Downloader, MB
+
+BUCKET = 'catalogger-test'
+KEY = 'ephys/u0/derived/kilosort2/exp0_acqm.zip'
+
+
+@pytest.fixture
+def s3():
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def listed(s3, key=KEY):
+    return next(obj for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix=key)['Contents'] if obj['Key'] == key)
+
+
+def get_object_spy(s3, monkeypatch):
+    calls = []
+    get_object = s3.get_object
+
+    def spy(**kwargs):
+        calls.append(kwargs)
+        return get_object(**kwargs)
+    monkeypatch.setattr(s3, 'get_object', spy)
+    return calls
+
+
+def test_resume_continues_partial_of_same_object(s3, tmp_path, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 400 + b'B' * 600)
+    obj = listed(s3)
+    path = tmp_path / 'exp0_acqm.zip'
+    (tmp_path / 'exp0_acqm.zip.part').write_bytes(b'A' * 400)
+    (tmp_path / 'exp0_acqm.zip.part.etag').write_text(obj['ETag'])
+    calls = get_object_spy(s3, monkeypatch)
+
+    assert S3Downloader(None, BUCKET, client=s3).download_object(obj, str(path)) == 'downloaded'
+    assert path.read_bytes() == b'A' * 400 + b'B' * 600
+    assert [call.get('Range') for call in calls] == ['bytes=400-']
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['exp0_acqm.zip']
+
+
+def test_resume_discards_partial_of_replaced_object(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 1000)
+    old = listed(s3)
+    (tmp_path / 'exp0_acqm.zip.part').write_bytes(b'A' * 400)
+    (tmp_path / 'exp0_acqm.zip.part.etag').write_text(old['ETag'])
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'B' * 1000)
+    path = tmp_path / 'exp0_acqm.zip'
+
+    assert S3Downloader(None, BUCKET, client=s3).download_object(listed(s3), str(path)) == 'downloaded'
+    assert path.read_bytes() == b'B' * 1000
+
+
+def test_resume_discards_partial_without_etag(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'B' * 1000)
+    (tmp_path / 'exp0_acqm.zip.part').write_bytes(b'A' * 400)
+    path = tmp_path / 'exp0_acqm.zip'
+
+    S3Downloader(None, BUCKET, client=s3).download_object(listed(s3), str(path))
+    assert path.read_bytes() == b'B' * 1000
+
+
+def test_resume_restarts_when_object_changes_after_listing(s3, tmp_path, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 1000)
+    old = listed(s3)
+    (tmp_path / 'exp0_acqm.zip.part').write_bytes(b'A' * 400)
+    (tmp_path / 'exp0_acqm.zip.part.etag').write_text(old['ETag'])
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'B' * 1000)
+    path = tmp_path / 'exp0_acqm.zip'
+    calls = get_object_spy(s3, monkeypatch)
+
+    # The listing is stale, so the ranged GET fails its IfMatch and the download starts over
+    assert S3Downloader(None, BUCKET, client=s3, retries=0).download_object(old, str(path)) == 'downloaded'
+    assert path.read_bytes() == b'B' * 1000
+    assert [call.get('Range') for call in calls] == ['bytes=400-', None]
+
+
+def test_list_objects_follows_pagination(s3):
+    for i in range(1005):
+        s3.put_object(Bucket=BUCKET, Key=f'ephys/u0/derived/kilosort2/exp{i:04d}_acqm.zip', Body=b'x')
+    s3.put_object(Bucket=BUCKET, Key='ephys/u0/derived/kilosort2/notes.txt', Body=b'x')
+    downloader = S3Downloader(None, BUCKET, client=s3)
+
+    assert len(downloader.list_objects('ephys/u0/')) == 1006
+    assert len(downloader.list_objects('ephys/u0/', suffix='_acqm.zip')) == 1005
+
+
+def test_download_skips_current_files_by_size(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 100)
+    path = tmp_path / 'exp0_acqm.zip'
+    path.write_bytes(b'B' * 100)
+    downloader = S3Downloader(None, BUCKET, client=s3)
+
+    assert downloader.download_object(listed(s3), str(path)) == 'skipped'
+    assert path.read_bytes() == b'B' * 100
+    path.write_bytes(b'B' * 99)
+    assert downloader.download_object(listed(s3), str(path)) == 'downloaded'
+    assert path.read_bytes() == b'A' * 100
+
+
+def test_download_skips_current_files_by_etag(s3, tmp_path):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 100)
+    path = tmp_path / 'exp0_acqm.zip'
+    path.write_bytes(b'B' * 100)
+    downloader = S3Downloader(None, BUCKET, client=s3, check='etag')
+
+    # Same size, different contents
+    assert downloader.download_object(listed(s3), str(path)) == 'downloaded'
+    assert path.read_bytes() == b'A' * 100
+    assert downloader.download_object(listed(s3), str(path)) == 'skipped'
+
+
+@pytest.mark.parametrize('part_size', [5 * MB, 8 * MB])
+def test_multipart_etag_matches_local_file(s3, tmp_path, part_size):
+    body = bytes(range(256)) * (4 * (3 * MB + 17) // 256)
+    upload = s3.create_multipart_upload(Bucket=BUCKET, Key=KEY)
+    parts = []
+    for number, start in enumerate(range(0, len(body), part_size), 1):
+        part = s3.upload_part(Bucket=BUCKET, Key=KEY, UploadId=upload['UploadId'], PartNumber=number,
+                              Body=body[start:start + part_size])
+        parts.append({'PartNumber': number, 'ETag': part['ETag']})
+    s3.complete_multipart_upload(Bucket=BUCKET, Key=KEY, UploadId=upload['UploadId'],
+                                 MultipartUpload={'Parts': parts})
+    obj = listed(s3)
+    assert obj['ETag'].strip('"').endswith(f'-{len(parts)}')
+    path = tmp_path / 'exp0_acqm.zip'
+    path.write_bytes(body)
+    downloader = S3Downloader(None, BUCKET, client=s3, check='etag', multipart_chunksize=5 * MB)
+
+    assert downloader.is_current(obj, str(path))
+    path.write_bytes(body[:-1] + b'\0')
+    assert not downloader.is_current(obj, str(path))
+
+
+def test_download_large_object_in_ranged_parts(s3, tmp_path):
+    body = bytes(range(256)) * (3 * MB // 256)
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=body)
+    path = tmp_path / 'exp0_acqm.zip'
+    downloader = S3Downloader(None, BUCKET, client=s3, multipart_threshold=MB, multipart_chunksize=MB)
+
+    assert downloader.download_object(listed(s3), str(path)) == 'downloaded'
+    assert path.read_bytes() == body
+
+
+def test_download_retries_with_backoff(s3, tmp_path, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 100)
+    get_object = s3.get_object
+    failures = [ConnectionError('reset'), ConnectionError('reset')]
+
+    def flaky(**kwargs):
+        if failures:
+            raise failures.pop(0)
+        return get_object(**kwargs)
+    monkeypatch.setattr(s3, 'get_object', flaky)
+    delays = []
+    monkeypatch.setattr(s3_downloader.time, 'sleep', delays.append)
+    monkeypatch.setattr(s3_downloader.random, 'random', lambda: 0.0)
+    path = tmp_path / 'exp0_acqm.zip'
+
+    assert S3Downloader(None, BUCKET, client=s3, retries=2, backoff=0.5).download_object(
+        listed(s3), str(path)) == 'downloaded'
+    assert delays == [0.5, 1.0]
+    assert path.read_bytes() == b'A' * 100
+
+
+def test_download_reports_failure_after_retries(s3, tmp_path, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'A' * 100)
+
+    def broken(**kwargs):
+        raise ConnectionError('reset')
+    monkeypatch.setattr(s3, 'get_object', broken)
+    delays = []
+    monkeypatch.setattr(s3_downloader.time, 'sleep', delays.append)
+    downloader = S3Downloader(None, BUCKET, client=s3, retries=3, backoff=0.1)
+
+    results = downloader.download([(listed(s3), str(tmp_path / 'exp0_acqm.zip'))], progress=None)
+    assert results['failed'] == {KEY: 'reset'}
+    assert len(delays) == 3
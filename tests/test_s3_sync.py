@@ -0,0 +1,120 @@
+import io
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from catalogger.s3_downloader import S3Downloader
+from catalogger.s3_sync import sync, sync_and_update, plan, affected_rows, mark_stale
+
+BUCKET = 'catalogger-test'
+SUFFIX = '_acqm.zip'
+KEY = 'ephys/u0/derived/kilosort2/exp0' + SUFFIX
+
+
+def acqm_bytes(num_units):
+    rng = np.random.default_rng(num_units)
+    train = {u: np.sort(rng.integers(0, 20000 * 60, 50)) for u in range(num_units)}
+    npz = io.BytesIO()
+    np.savez(npz, train=train, fs=20000.0, neuron_data={u: {} for u in train}, config={})
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as f:
+        f.writestr('qm.npz', npz.getvalue())
+    return out.getvalue()
+
+
+@pytest.fixture
+def s3():
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def AcqmLoader():
+    # Only the catalog update tests need braingeneers
+    pytest.importorskip('braingeneers')
+    from catalogger.Loaders import AcqmLoader
+    return AcqmLoader
+
+
+def catalog():
+    return pd.DataFrame({'uuids': ['u0'], 'experiment_name': ['exp0'], 'org_age': ['30 days']})
+
+
+def test_plan_compares_listing_to_manifest(s3, tmp_path):
+    for key in ['ephys/u0/derived/kilosort2/exp0_acqm.zip', 'ephys/u0/derived/kilosort2/exp1_acqm.zip',
+                'ephys/u0/derived/autocuration/exp1_acqm.zip', 'ephys/u0/derived/autocuration/exp2_acqm.zip']:
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b'x' * 10)
+    (tmp_path / 'u0').mkdir()
+    (tmp_path / 'u0' / 'exp0_acqm.zip').write_bytes(b'x' * 10)
+    downloader = S3Downloader(None, BUCKET, client=s3)
+    etag = downloader.list_objects(KEY)[0]['ETag']
+    manifest = {KEY: {'etag': etag, 'size': 10, 'local_path': 'u0/exp0_acqm.zip'},
+                'ephys/u0/derived/kilosort2/gone_acqm.zip': {'etag': etag, 'size': 10, 'local_path': 'u0/gone_acqm.zip'},
+                'ephys/u1/derived/kilosort2/other_acqm.zip': {'etag': etag, 'size': 10, 'local_path': 'u1/other_acqm.zip'}}
+
+    changed, current, removed = plan(downloader, ['u0'], str(tmp_path), manifest)
+    # The kilosort2 copy of exp1 wins over the autocuration one
+    assert [obj['Key'] for obj, _ in changed] == ['ephys/u0/derived/kilosort2/exp1_acqm.zip',
+                                                 'ephys/u0/derived/autocuration/exp2_acqm.zip']
+    assert [path for _, path in changed] == [str(tmp_path / 'u0' / 'exp1_acqm.zip'), str(tmp_path / 'u0' / 'exp2_acqm.zip')]
+    assert [obj['Key'] for obj, _ in current] == [KEY]
+    assert removed == ['ephys/u0/derived/kilosort2/gone_acqm.zip']
+
+    manifest[KEY]['etag'] = '"changed"'
+    changed, current, _ = plan(downloader, ['u0'], str(tmp_path), manifest)
+    assert KEY in [obj['Key'] for obj, _ in changed] and current == []
+
+
+def test_affected_rows_match_experiment_files(tmp_path):
+    rows = pd.DataFrame({'uuids': ['u0', 'u0', 'u0', 'u1'], 'experiment_name': ['exp0', 'exp1', 'exp10', 'exp0']})
+    paths = [str(tmp_path / 'u0' / 'exp1_acqm.zip'), str(tmp_path / 'u0' / 'exp0_params_acqm.zip')]
+
+    assert affected_rows(rows, paths, str(tmp_path)).tolist() == [True, True, False, False]
+    assert not affected_rows(rows, [], str(tmp_path)).any()
+
+
+def test_mark_stale_clears_selected_rows():
+    rows = pd.DataFrame({'experiment_name': ['exp0', 'exp1'], 'processed': [True, True],
+                         'metric_versions': ['{"num_units": 1}'] * 2, 'data_obj': ['sd0', 'sd1']})
+
+    assert mark_stale(rows, ['exp1']) is rows
+    assert rows['processed'].tolist() == [True, False]
+    assert rows['metric_versions'].isna().tolist() == [False, True]
+    assert rows['data_obj'].isna().tolist() == [False, True]
+    mark_stale(rows, pd.Series([True, False]))
+    assert rows['processed'].tolist() == [False, False]
+
+
+def test_changed_file_is_reloaded_after_sync(s3, tmp_path, AcqmLoader):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=acqm_bytes(1))
+    downloader = S3Downloader(None, BUCKET, client=s3)
+    sync(catalog(), str(tmp_path), downloader=downloader, progress=None)
+    loader = AcqmLoader(str(tmp_path), catalog())
+    loader.update_catalog(gen_metrics=True, suffix=SUFFIX, progress=None)
+    assert loader.catalog.loc[0, 'num_units'] == 1
+
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=acqm_bytes(9))
+    result = sync(loader.catalog, str(tmp_path), downloader=downloader, progress=None)
+    mark_stale(loader.catalog, result['affected'])
+    assert loader.catalog.loc[0, 'data_obj'] is None
+    loader.update_catalog(gen_metrics=True, suffix=SUFFIX, progress=None)
+    assert loader.catalog.loc[0, 'num_units'] == 9
+
+
+def test_sync_and_update_reloads_changed_file(s3, tmp_path, AcqmLoader):
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=acqm_bytes(1))
+    loader = AcqmLoader(str(tmp_path), catalog())
+    sync_and_update(loader, downloader=S3Downloader(None, BUCKET, client=s3), progress=None,
+                    gen_metrics=True, suffix=SUFFIX)
+    assert loader.catalog.loc[0, 'num_units'] == 1
+
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=acqm_bytes(9))
+    sync_and_update(loader, downloader=S3Downloader(None, BUCKET, client=s3), progress=None,
+                    gen_metrics=True, suffix=SUFFIX)
+    assert loader.catalog.loc[0, 'num_units'] == 9
@@ -0,0 +1,48 @@
+import io
+import os
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('braingeneers')
+
+from catalogger.Loaders import AcqmLoader
+
+SUFFIX = '_params_params_low_ISI_acqm.zip'
+
+
+def write_acqm(path, units, fs=20000.0):
+    rng = np.random.default_rng(len(units))
+    train = {u: np.sort(rng.integers(0, int(fs) * 60, 20)) for u in units}
+    npz = io.BytesIO()
+    np.savez(npz, train=train, fs=fs, neuron_data={u: {} for u in train}, config={'threshold': 5})
+    with zipfile.ZipFile(path, 'w') as f:
+        f.writestr('qm.npz', npz.getvalue())
+
+
+@pytest.fixture
+def loader(tmp_path):
+    (tmp_path / 'u0').mkdir()
+    write_acqm(tmp_path / 'u0' / f'exp0{SUFFIX}', [11, 17], fs=30000.0)
+    loader = AcqmLoader(str(tmp_path), pd.DataFrame({'uuids': ['u0'], 'experiment_name': ['exp0'],
+                                                     'org_age': ['30 days']}))
+    loader.update_catalog(progress=None)
+    return loader
+
+
+def test_snapshot_keeps_fs_units_and_config(loader, tmp_path):
+    path = loader.save_snapshot(str(tmp_path / 'snapshot'))
+    store = os.path.join(path, 'spikes', 'u0', 'exp0.spikes')
+    with open(os.path.join(store, 'meta.json')) as f:
+        meta = json.load(f)
+    assert meta['fs'] == 30000.0
+    assert meta['units'] == [11, 17]
+    assert AcqmLoader.load_curation(store, fields={'fs', 'config'}) == {'fs': 30000.0, 'config': {'threshold': 5}}
+
+
+def test_snapshot_refuses_store_without_fs(loader, tmp_path):
+    os.remove(tmp_path / 'u0' / f'exp0{SUFFIX}')
+    with pytest.raises(ValueError, match='no \'fs\''):
+        loader.save_snapshot(str(tmp_path / 'snapshot'))
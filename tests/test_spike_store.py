@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from catalogger import spike_store
+
+
+def test_overwrite_replaces_whole_store(tmp_path):
+    out = str(tmp_path / 'exp0_acqm.spikes')
+    spike_store.write_store(out, [np.arange(5.0), np.arange(3.0)], 20000.0, units=[3, 8])
+    old_train, _, _, _ = spike_store.load_store(out)
+
+    assert spike_store.write_store(out, [np.array([1.5])], 30000.0, units=[4]) == out
+    train, _, _, fs = spike_store.load_store(out)
+    assert fs == 30000.0 and spike_store.read_meta(out)['units'] == [4]
+    assert [t.tolist() for t in train] == [[1.5]]
+    # Arrays mapped from the old store stay readable
+    assert [t.tolist() for t in old_train] == [list(range(5)), list(range(3))]
+    assert [p.name for p in tmp_path.iterdir()] == ['exp0_acqm.spikes']
+
+
+def test_failed_overwrite_keeps_old_store(tmp_path, monkeypatch):
+    out = str(tmp_path / 'exp0_acqm.spikes')
+    spike_store.write_store(out, [np.arange(5.0)], 20000.0)
+
+    def broken(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(spike_store.pickle, 'dump', broken)
+    with pytest.raises(OSError, match='disk full'):
+        spike_store.write_store(out, [np.array([1.5])], 30000.0)
+    train, _, _, fs = spike_store.load_store(out, load_neuron_data=False)
+    assert fs == 20000.0 and [t.tolist() for t in train] == [list(range(5))]
+    assert [p.name for p in tmp_path.iterdir()] == ['exp0_acqm.spikes']